@@ -0,0 +1,166 @@
+#  This file is part of initviz.
+
+#  initviz is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  initviz is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with initviz. If not, see <http://www.gnu.org/licenses/>.
+
+"""On-disk cache of parsed and compiled traces.
+
+A cache entry is the pickled Trace, keyed on the content of the bootchart
+files and the options which change the outcome of parsing.  Entries are
+evicted least recently used first once the cache grows beyond its size
+limit.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+from . import parsing
+
+# Bump whenever the layout of the pickled classes changes
+CACHE_VERSION = 13
+
+# Options which affect the parsed and compiled trace
+KEY_OPTIONS = ('prune', 'crop_after', 'crop_idle_threshold', 'crop_idle_window',
+               'annotate', 'show_kernel', 'proc_sort', 'sibling_merge', 'passes',
+               'only_subtree', 'exclude_subtree')
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+def default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_home, 'initviz')
+
+def _hash_path(digest, path):
+    """Feed the names and contents of a file or directory into digest."""
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            _hash_path(digest, os.path.join(path, name))
+        return
+    if not os.path.isfile(path):
+        return
+    digest.update(os.path.basename(path).encode('utf-8', 'surrogateescape'))
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+class _TracePickler(pickle.Pickler):
+    """The writer holds on to the output stream, so it is stored as a
+       reference, to be replaced by the writer of whoever loads the trace."""
+    def __init__(self, file, writer):
+        pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+        self.writer = writer
+
+    def persistent_id(self, obj):
+        if obj is self.writer:
+            return 'writer'
+        return None
+
+class _TraceUnpickler(pickle.Unpickler):
+    def __init__(self, file, writer):
+        pickle.Unpickler.__init__(self, file)
+        self.writer = writer
+
+    def persistent_load(self, pid):
+        if pid == 'writer':
+            return self.writer
+        raise pickle.UnpicklingError("unknown reference '%s'" % pid)
+
+class TraceCache:
+    def __init__(self, path=None, max_size=DEFAULT_MAX_SIZE):
+        self.path = path or default_cache_dir()
+        self.max_size = max_size
+
+    def key(self, paths, options):
+        """Returns the cache key for parsing paths with options."""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(repr((CACHE_VERSION, [os.path.abspath(p) for p in paths],
+                            [getattr(options, o, None) for o in KEY_OPTIONS])).encode('utf-8'))
+        for path in paths:
+            _hash_path(digest, path)
+        return digest.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.path, key + '.trace')
+
+    def load(self, writer, key):
+        """Returns the cached trace for key, or None."""
+        entry = self.entry(key)
+        try:
+            with open(entry, 'rb') as f:
+                trace = _TraceUnpickler(f, writer).load()
+        except FileNotFoundError:
+            return None
+        except Exception as err:
+            writer.info("ignoring unreadable cache entry '%s': %s" % (entry, err))
+            return None
+        # remember it as recently used
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return trace
+
+    def store(self, writer, key, trace):
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    _TracePickler(f, writer).dump(trace)
+                os.replace(tmp, self.entry(key))
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except (OSError, pickle.PicklingError, RecursionError) as err:
+            writer.info("could not cache trace: %s" % err)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits."""
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.trace'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(os.path.join(self.path, name))
+            except OSError:
+                continue
+            total -= size
+
+def load_trace(writer, paths, options):
+    """Returns the Trace for paths, from the cache when possible."""
+    if not getattr(options, 'cache', True):
+        return parsing.Trace(writer, paths, options)
+
+    cache = TraceCache()
+    key = cache.key(paths, options)
+    trace = cache.load(writer, key)
+    if trace is not None:
+        writer.status("loaded '%s' from cache" % ", ".join(paths))
+        return trace
+
+    trace = parsing.Trace(writer, paths, options)
+    cache.store(writer, key, trace)
+    return trace
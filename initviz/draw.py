@@ -16,12 +16,18 @@
 
 import cairo
 import functools
+import itertools
 import math
 import re
 import random
+import threading
+import weakref
 import colorsys
+from collections import OrderedDict
 from operator import itemgetter
 
+from .samples import ProcessSamples
+
 # Track whether we've warned about degenerate data
 _warned_degenerate = False
 
@@ -146,6 +152,9 @@ STAT_TYPE_IO = 1
 def get_proc_state(flag):
 	return "RSDTZXW".find(flag) + 1
 
+# Same, for the character codes kept in a ProcessSamples store
+PROC_STATE_CODES = dict((ord(flag), get_proc_state(flag)) for flag in "RSDTZXW")
+
 def draw_text(ctx, text, color, x, y):
 	ctx.set_source_rgba(*color)
 	ctx.move_to(x, y)
@@ -225,7 +234,69 @@ def draw_annotations(ctx, proc_tree, times, rect):
     ctx.set_line_cap(cairo.LINE_CAP_BUTT)
     ctx.set_dash([])
 
-def draw_chart(ctx, color, fill, chart_bounds, data, proc_tree, data_range):
+class ChartSeries:
+	"""The (time, value) points of a chart, ordered by time.  To draw them,
+	they are reduced to the first, lowest, highest and last point of each
+	pixel column, which looks the same.  The reductions are cached per
+	scale, so redrawing takes time in proportion to the chart width rather
+	than to the number of samples."""
+	# reductions kept, for the scales most recently drawn at
+	MAX_REDUCED = 8
+
+	def __init__(self, points):
+		self.points = points
+		self.max_x = max (x for (x, y) in points)
+		self.max_point = max (points, key = itemgetter(1))
+		self.max_y = self.max_point[1]
+		self.reduced = OrderedDict()
+
+	def reduce(self, x_shift, px_scale):
+		"""Returns the points to draw when a time unit is px_scale pixels
+		wide, from x_shift on."""
+		key = (x_shift, px_scale)
+		points = self.reduced.get(key)
+		if points is None:
+			if len(self.reduced) >= self.MAX_REDUCED:
+				self.reduced.popitem(last=False)
+			points = self.reduced[key] = reduce_to_columns(self.points, x_shift, px_scale)
+		else:
+			self.reduced.move_to_end(key)
+		return points
+
+def reduce_to_columns(points, x_shift, px_scale):
+	"""Reduces points to the first, lowest, highest and last point of each
+	pixel column, in time order."""
+	if len(points) <= 4 * ((points[-1][0] - x_shift) * px_scale + 1):
+		return points
+	reduced = []
+	start, count = 0, len(points)
+	while start < count:
+		column = math.floor((points[start][0] - x_shift) * px_scale)
+		low = high = start
+		end = start + 1
+		while end < count and math.floor((points[end][0] - x_shift) * px_scale) == column:
+			if points[end][1] < points[low][1]:
+				low = end
+			elif points[end][1] > points[high][1]:
+				high = end
+			end += 1
+		for i in sorted(set((start, low, high, end - 1))):
+			reduced.append(points[i])
+		start = end
+	return reduced
+
+# the ChartSeries of each trace, by name
+_chart_series = weakref.WeakKeyDictionary()
+
+def chart_series(trace, name, make_points):
+	"""Returns the ChartSeries called name of trace, made from the points
+	returned by make_points() the first time it is asked for."""
+	series = _chart_series.setdefault(trace, {})
+	if name not in series:
+		series[name] = ChartSeries(make_points())
+	return series[name]
+
+def draw_chart(ctx, color, fill, chart_bounds, series, proc_tree, data_range):
 	ctx.set_line_width(0.5)
 	x_shift = proc_tree.start_time
 
@@ -235,12 +306,14 @@ def draw_chart(ctx, color, fill, chart_bounds, data, proc_tree, data_range):
 		y = (point[1] - y_base) * -yscale + y_trans + chart_bounds[3]
 		return x, y
 
-	max_x = max (x for (x, y) in data)
-	max_y = max (y for (x, y) in data)
+	max_x = series.max_x
+	max_y = series.max_y
 	# avoid divide by zero
 	if max_y == 0:
 		max_y = 1.0
 	xscale = float (chart_bounds[2]) / max_x
+	# draw no more than a few points per pixel, zoomed in or out
+	data = series.reduce(x_shift, xscale * abs(ctx.user_to_device_distance(1.0, 0.0)[0]))
 	# If data_range is given, scale the chart so that the value range in
 	# data_range matches the chart bounds exactly.
 	# Otherwise, scale so that the actual data matches the chart bounds.
@@ -285,6 +358,8 @@ MIN_IMG_W = 800
 CUML_HEIGHT = 2000 # Increased value to accomodate CPU and I/O Graphs
 OPTIONS = None
 RENDER_OPTIONS = None
+# the above are set for the duration of a render
+_render_lock = threading.Lock()
 
 def extents(options, xscale, trace):
 	proc_tree = options.proc_tree(trace)
@@ -303,8 +378,9 @@ def clip_visible(clip, rect):
 	ymin = min (clip[1] + clip[3], rect[1] + rect[3])
 	return (xmin > xmax and ymin > ymax)
 
-def render_charts(ctx, options, clip, trace, curr_y, w, h, sec_w):
+def render_charts(ctx, options, clip, trace, layout, sec_w):
 	proc_tree = options.proc_tree(trace)
+	curr_y = layout.bands['cpu'][1] - 30
 
 	# render bar legend
 	ctx.set_font_size(LEGEND_FONT_SIZE)
@@ -313,16 +389,18 @@ def render_charts(ctx, options, clip, trace, curr_y, w, h, sec_w):
 	draw_legend_box(ctx, "I/O (wait)", IO_COLOR, off_x + 120, curr_y+20, leg_s)
 
 	# render I/O wait
-	chart_rect = (off_x, curr_y+30, w, bar_h)
+	chart_rect = layout.bands['cpu']
 	if clip_visible (clip, chart_rect):
 		draw_box_ticks (ctx, chart_rect, sec_w)
 		draw_annotations (ctx, proc_tree, trace.times, chart_rect)
 		draw_chart (ctx, IO_COLOR, True, chart_rect, \
-			    [(sample.time, sample.user + sample.sys + sample.io) for sample in trace.cpu_stats], \
+			    chart_series(trace, 'cpu_io', lambda: \
+				[(sample.time, sample.user + sample.sys + sample.io) for sample in trace.cpu_stats]), \
 			    proc_tree, None)
 		# render CPU load
 		draw_chart (ctx, CPU_COLOR, True, chart_rect, \
-			    [(sample.time, sample.user + sample.sys) for sample in trace.cpu_stats], \
+			    chart_series(trace, 'cpu', lambda: \
+				[(sample.time, sample.user + sample.sys) for sample in trace.cpu_stats]), \
 			    proc_tree, None)
 
 	curr_y = curr_y + 30 + bar_h
@@ -332,74 +410,83 @@ def render_charts(ctx, options, clip, trace, curr_y, w, h, sec_w):
 	draw_legend_box(ctx, "Disk utilization", IO_COLOR, off_x + 120, curr_y+20, leg_s)
 
         # render I/O utilization
-	chart_rect = (off_x, curr_y+30, w, bar_h)
+	chart_rect = layout.bands['disk']
 	if clip_visible (clip, chart_rect):
 		draw_box_ticks (ctx, chart_rect, sec_w)
 		draw_annotations (ctx, proc_tree, trace.times, chart_rect)
 		draw_chart (ctx, IO_COLOR, True, chart_rect, \
-			    [(sample.time, sample.util) for sample in trace.disk_stats], \
+			    chart_series(trace, 'disk_util', lambda: \
+				[(sample.time, sample.util) for sample in trace.disk_stats]), \
 			    proc_tree, None)
 
 	# render disk throughput
-	max_sample = max (trace.disk_stats, key = lambda s: s.tput)
+	tput = chart_series(trace, 'disk_tput', lambda: \
+		[(sample.time, sample.tput) for sample in trace.disk_stats])
+	max_time, max_tput = tput.max_point
 	if clip_visible (clip, chart_rect):
-		draw_chart (ctx, DISK_TPUT_COLOR, False, chart_rect, \
-			    [(sample.time, sample.tput) for sample in trace.disk_stats], \
-			    proc_tree, None)
+		draw_chart (ctx, DISK_TPUT_COLOR, False, chart_rect, tput, proc_tree, None)
 
-	pos_x = off_x + ((max_sample.time - proc_tree.start_time) * w / proc_tree.duration)
+	pos_x = off_x + ((max_time - proc_tree.start_time) * layout.width / proc_tree.duration)
 
 	shift_x, shift_y = -20, 20
 	if (pos_x < off_x + 245):
 		shift_x, shift_y = 5, 40
 
-	label = "%dMB/s" % round ((max_sample.tput) / 1024.0)
+	label = "%dMB/s" % round ((max_tput) / 1024.0)
 	draw_text (ctx, label, DISK_TPUT_COLOR, pos_x + shift_x, curr_y + shift_y)
 
 	curr_y = curr_y + 30 + bar_h
 
 	# render mem usage
-	chart_rect = (off_x, curr_y+30, w, meminfo_bar_h)
+	chart_rect = layout.bands.get('mem')
 	mem_stats = trace.mem_stats
-	if mem_stats and clip_visible (clip, chart_rect):
-		mem_scale = max(sample.records['MemTotal'] - sample.records['MemFree'] for sample in mem_stats)
+	if chart_rect and clip_visible (clip, chart_rect):
+		mem_buffers = chart_series(trace, 'mem_buffers', lambda: \
+			[(sample.time, sample.mem_total - sample.mem_free) for sample in mem_stats])
+		mem_swap = chart_series(trace, 'mem_swap', lambda: \
+			[(sample.time, float(sample.swap_total - sample.swap_free)) for sample in mem_stats])
+		mem_scale = mem_buffers.max_y
 		draw_legend_box(ctx, "Mem cached (scale: %u MiB)" % (float(mem_scale) / 1024), MEM_CACHED_COLOR, off_x, curr_y+20, leg_s)
 		draw_legend_box(ctx, "Used", MEM_USED_COLOR, off_x + 240, curr_y+20, leg_s)
 		draw_legend_box(ctx, "Buffers", MEM_BUFFERS_COLOR, off_x + 360, curr_y+20, leg_s)
-		draw_legend_line(ctx, "Swap (scale: %u MiB)" % max([(sample.records['SwapTotal'] - sample.records['SwapFree'])/1024 for sample in mem_stats]), \
+		draw_legend_line(ctx, "Swap (scale: %u MiB)" % (mem_swap.max_y / 1024), \
 				 MEM_SWAP_COLOR, off_x + 480, curr_y+20, leg_s)
 		draw_box_ticks(ctx, chart_rect, sec_w)
 		draw_annotations(ctx, proc_tree, trace.times, chart_rect)
-		draw_chart(ctx, MEM_BUFFERS_COLOR, True, chart_rect, \
-			   [(sample.time, sample.records['MemTotal'] - sample.records['MemFree']) for sample in trace.mem_stats], \
+		draw_chart(ctx, MEM_BUFFERS_COLOR, True, chart_rect, mem_buffers, \
 			   proc_tree, [0, mem_scale])
 		draw_chart(ctx, MEM_USED_COLOR, True, chart_rect, \
-			   [(sample.time, sample.records['MemTotal'] - sample.records['MemFree'] - sample.records['Buffers']) for sample in mem_stats], \
+			   chart_series(trace, 'mem_used', lambda: \
+				[(sample.time, sample.mem_total - sample.mem_free - sample.buffers) for sample in mem_stats]), \
 			   proc_tree, [0, mem_scale])
 		draw_chart(ctx, MEM_CACHED_COLOR, True, chart_rect, \
-			   [(sample.time, sample.records['Cached']) for sample in mem_stats], \
+			   chart_series(trace, 'mem_cached', lambda: \
+				[(sample.time, sample.cached) for sample in mem_stats]), \
 			   proc_tree, [0, mem_scale])
-		draw_chart(ctx, MEM_SWAP_COLOR, False, chart_rect, \
-			   [(sample.time, float(sample.records['SwapTotal'] - sample.records['SwapFree'])) for sample in mem_stats], \
+		draw_chart(ctx, MEM_SWAP_COLOR, False, chart_rect, mem_swap, \
 			   proc_tree, None)
 
-		curr_y = curr_y + meminfo_bar_h
-
-	return curr_y
-
 #
 # Render the chart.
 #
 def render(ctx, options, xscale, trace):
+	"""Render the chart, returns its ChartLayout.  Safe to call from
+	several threads, which take turns."""
+	with _render_lock:
+		return _render(ctx, options, xscale, trace)
+
+def _render(ctx, options, xscale, trace):
 	(w, h) = extents (options, xscale, trace)
 	global OPTIONS, RENDER_OPTIONS
 	OPTIONS = options.app_options
 	RENDER_OPTIONS = options
 
 	proc_tree = options.proc_tree(trace)
+	layout = chart_layout(ctx, options, xscale, trace)
 
 	# x, y, w, h
-	clip = ctx.clip_extents()
+	x1, y1, x2, y2 = ctx.clip_extents()
+	clip = (x1, y1, x2 - x1, y2 - y1)
 
 	sec_w = int (xscale * sec_w_base)
 	ctx.set_line_width(1.0)
@@ -414,38 +501,145 @@ def render(ctx, options, xscale, trace):
 
 	if not options.kernel_only:
 		boot_time = proc_tree.boot_time or duration
-		curr_y = draw_header(ctx, trace.headers, boot_time)
-	else:
-		curr_y = off_y;
+		draw_header(ctx, trace.headers, boot_time)
 
 	if options.charts:
-		curr_y = render_charts(ctx, options, clip, trace, curr_y, w, h, sec_w)
+		render_charts(ctx, options, clip, trace, layout, sec_w)
 
 	# draw process boxes
-	proc_height = h
-	if proc_tree.taskstats and options.cumulative:
-		proc_height -= CUML_HEIGHT
-
-	draw_process_bar_chart(ctx, clip, options, proc_tree, trace.times,
-			       curr_y, w, proc_height, sec_w)
+	draw_process_bar_chart(ctx, clip, options, proc_tree, trace.times, layout, sec_w)
 
-	curr_y = proc_height
 	# ctx.set_font_size(SIG_FONT_SIZE)
 	# draw_text(ctx, SIGNATURE, SIG_COLOR, off_x + 5, proc_height - 8)
 
 	# draw a cumulative CPU-time-per-process graph
-	if proc_tree.taskstats and options.cumulative:
-		cuml_rect = (off_x, curr_y + off_y, w, CUML_HEIGHT/2 - off_y * 2)
-		if clip_visible (clip, cuml_rect):
-			draw_cuml_graph(ctx, proc_tree, cuml_rect, duration, sec_w, STAT_TYPE_CPU)
+	cuml_rect = layout.bands.get('cuml_cpu')
+	if cuml_rect and clip_visible (clip, cuml_rect):
+		draw_cuml_graph(ctx, proc_tree, cuml_rect, duration, sec_w, STAT_TYPE_CPU)
 
 	# draw a cumulative I/O-time-per-process graph
+	cuml_rect = layout.bands.get('cuml_io')
+	if cuml_rect and clip_visible (clip, cuml_rect):
+		draw_cuml_graph(ctx, proc_tree, cuml_rect, duration, sec_w, STAT_TYPE_IO)
+
+	return layout
+
+class ChartLayout:
+	"""Where render() puts the parts of a chart, in chart coordinates: the
+	rectangles of the chart bands by name ('cpu', 'disk' and 'mem' for the
+	charts, 'processes' for the process tree, 'cuml_cpu' and 'cuml_io' for
+	the cumulative graphs) and the rows of the process tree."""
+	def __init__(self, proc_tree, width, height, header_y, bands, proc_top, rows_y):
+		self.proc_tree = proc_tree
+		self.width = width
+		self.height = height
+		self.header_y = header_y
+		self.bands = bands
+		# the top of the process tree legend, and of its first row
+		self.proc_top = proc_top
+		self.rows_y = rows_y
+		self.proc_h = proc_h
+
+	def row_y(self, row):
+		return self.rows_y + row * self.proc_h
+
+	def row_at(self, y):
+		"""Returns the process tree row at y, or None."""
+		row = int(math.floor((y - self.rows_y) / self.proc_h))
+		if 0 <= row < self.proc_tree.num_proc:
+			return row
+		return None
+
+	def proc_rect(self, row):
+		"""Returns the (x, y, w, h) of the process box in row."""
+		proc_tree = self.proc_tree
+		proc = proc_tree.rows[row]
+		rect = self.bands['processes']
+		return (rect[0] + (proc.start_time - proc_tree.start_time) * rect[2] / proc_tree.duration,
+			self.row_y(row), proc.duration * rect[2] / proc_tree.duration, self.proc_h)
+
+	def proc_at(self, x, y):
+		"""Returns the process whose box is at (x, y), or None."""
+		row = self.row_at(y)
+		if row is None:
+			return None
+		px, _, pw, _ = self.proc_rect(row)
+		if px <= x <= px + pw:
+			return self.proc_tree.rows[row]
+		return None
+
+	def time_at(self, x):
+		"""Returns the time on the process tree's timeline at x."""
+		proc_tree = self.proc_tree
+		rect = self.bands['processes']
+		return proc_tree.start_time + (x - rect[0]) * proc_tree.duration / rect[2]
+
+	def visible_rows(self, clip):
+		return visible_rows(self.proc_tree, self.rows_y, self.proc_h, clip)
+
+# the ChartLayouts of each trace, by options and scale
+_chart_layouts = weakref.WeakKeyDictionary()
+MAX_LAYOUTS = 16
+# the GUI looks up layouts while renders go on in the background
+_layouts_lock = threading.Lock()
+
+def chart_layout(ctx, options, xscale, trace):
+	"""Returns the ChartLayout of rendering trace with options at xscale.
+	It is worked out once, measuring the header text with ctx."""
+	proc_tree = options.proc_tree(trace)
+	key = (options.kernel_only, options.charts, options.cumulative, xscale)
+	with _layouts_lock:
+		layouts = _chart_layouts.setdefault(trace, {})
+		layout = layouts.get(key)
+		if layout is None or layout.proc_tree is not proc_tree:
+			if len(layouts) >= MAX_LAYOUTS:
+				layouts.clear()
+			layout = layouts[key] = make_layout(ctx, options, xscale, trace, proc_tree)
+		return layout
+
+def header_height(ctx):
+	"""Returns the height of the header, as draw_header() lays it out."""
+	ctx.save()
+	ctx.select_font_face(FONT_NAME)
+	header_y = ctx.font_extents()[2] + 10
+	ctx.set_font_size(TEXT_FONT_SIZE)
+	# the title is followed by four header lines and the boot time
+	header_y += 5 * ctx.font_extents()[2]
+	ctx.restore()
+	return header_y
+
+def make_layout(ctx, options, xscale, trace, proc_tree):
+	(w, h) = extents (options, xscale, trace)
+	w -= 2*off_x
+	if not options.kernel_only:
+		curr_y = header_height(ctx)
+	else:
+		curr_y = off_y
+	header_y = curr_y
+
+	bands = {}
+	if options.charts:
+		bands['cpu'] = (off_x, curr_y+30, w, bar_h)
+		curr_y = curr_y + 30 + bar_h
+		bands['disk'] = (off_x, curr_y+30, w, bar_h)
+		curr_y = curr_y + 30 + bar_h
+		if trace.mem_stats:
+			bands['mem'] = (off_x, curr_y+30, w, meminfo_bar_h)
+			curr_y = curr_y + meminfo_bar_h
+
+	proc_height = h
 	if proc_tree.taskstats and options.cumulative:
-		cuml_rect = (off_x, curr_y + off_y * 100, w, CUML_HEIGHT/2 - off_y * 2)
-		if clip_visible (clip, cuml_rect):
-			draw_cuml_graph(ctx, proc_tree, cuml_rect, duration, sec_w, STAT_TYPE_IO)
+		proc_height -= CUML_HEIGHT
+		bands['cuml_cpu'] = (off_x, proc_height + off_y, w, CUML_HEIGHT/2 - off_y * 2)
+		bands['cuml_io'] = (off_x, proc_height + off_y * 100, w, CUML_HEIGHT/2 - off_y * 2)
+
+	header_size = 0 if options.kernel_only else 45
+	bands['processes'] = (off_x, curr_y + header_size + 15,
+			      w, proc_height - 2 * off_y - (curr_y + header_size + 15) + proc_h)
+	return ChartLayout(proc_tree, w, h, header_y, bands, curr_y, curr_y + 60)
 
-def draw_process_bar_chart(ctx, clip, options, proc_tree, times, curr_y, w, h, sec_w):
+def draw_process_bar_chart(ctx, clip, options, proc_tree, times, layout, sec_w):
+	curr_y = layout.proc_top
 	header_size = 0
 	if not options.kernel_only:
 		draw_legend_box (ctx, "Running (%cpu)",
@@ -461,8 +655,7 @@ def draw_process_bar_chart(ctx, clip, options, proc_tree, times, curr_y, w, h, s
 					 EXIT_PROC_COLOR, off_x+480, curr_y + 45, leg_s)
 		header_size = 45
 
-	chart_rect = [off_x, curr_y + header_size + 15,
-		      w, h - 2 * off_y - (curr_y + header_size + 15) + proc_h]
+	chart_rect = layout.bands['processes']
 	ctx.set_font_size (PROC_TEXT_FONT_SIZE)
 
 	draw_box_ticks (ctx, chart_rect, sec_w)
@@ -475,10 +668,7 @@ def draw_process_bar_chart(ctx, clip, options, proc_tree, times, curr_y, w, h, s
 
 	# Track exit_proc position for drawing boot completion arrow
 	exit_proc_pos = {}
-	y = curr_y + 60
-	for root in proc_tree.process_tree:
-		draw_processes_recursively(ctx, root, proc_tree, y, proc_h, chart_rect, clip, exit_proc_pos)
-		y = y + proc_h * proc_tree.num_nodes([root])
+	draw_processes(ctx, proc_tree, layout.rows_y, proc_h, chart_rect, clip, exit_proc_pos)
 
 	# Draw boot completion arrow and time if exit_proc was found
 	if exit_proc_pos and proc_tree.boot_time is not None:
@@ -532,8 +722,50 @@ def process_matches_search(proc, search_query):
 				return True
 	return False
 
-def draw_processes_recursively(ctx, proc, proc_tree, y, proc_h, rect, clip, exit_proc_pos=None) :
-	x = rect[0] +  ((proc.start_time - proc_tree.start_time) * rect[2] / proc_tree.duration)
+def visible_rows(proc_tree, y, proc_h, clip):
+	"""Returns the (first, last + 1) rows of the process tree starting at y
+	   which are within the clip rectangle, with a row to spare either side.
+	   When there are none, first and last + 1 are the same."""
+	first = int(math.floor((clip[1] - y) / proc_h)) - 1
+	last = max(min(int(math.floor((clip[1] + clip[3] - y) / proc_h)) + 2, proc_tree.num_proc), 0)
+	return min(max(first, 0), last), last
+
+def draw_processes(ctx, proc_tree, y, proc_h, rect, clip, exit_proc_pos=None):
+	"""Draw the rows of the process tree within the clip rectangle, each
+	   process in its row starting at y, then the lines connecting them to
+	   their parents.  Parents above the clip rectangle, and children below
+	   it, still get the part of their lines which crosses it."""
+	def position(row):
+		proc = proc_tree.rows[row]
+		return rect[0] + ((proc.start_time - proc_tree.start_time) * rect[2] / proc_tree.duration), \
+		       y + proc_h * row
+
+	first, last = visible_rows(proc_tree, y, proc_h, clip)
+	for row in range(first, last):
+		px, py = position(row)
+		draw_process(ctx, proc_tree.rows[row], proc_tree, px, py, proc_h, rect, clip, exit_proc_pos)
+
+	if first >= last:
+		return
+	parent_rows = proc_tree.parent_rows
+	connected = []
+	# the ancestors of the first row, which are above it, topmost first
+	ancestor = parent_rows[first]
+	while ancestor is not None:
+		connected.append(ancestor)
+		ancestor = parent_rows[ancestor]
+	connected.reverse()
+	connected.extend(range(first, last))
+	for row in connected:
+		parent = parent_rows[row]
+		if row >= first and parent is not None:
+			draw_process_connecting_lines(ctx, *(position(parent) + position(row) + (proc_h,)))
+		# the line to the next child below passes by the children shown
+		child = proc_tree.first_child_from(proc_tree.rows[row], last)
+		if child is not None:
+			draw_process_connecting_lines(ctx, *(position(row) + position(proc_tree.row_of[child]) + (proc_h,)))
+
+def draw_process(ctx, proc, proc_tree, x, y, proc_h, rect, clip, exit_proc_pos=None):
 	w = ((proc.duration) * rect[2] / proc_tree.duration)
 
 	draw_process_activity_colors(ctx, proc, proc_tree, x, y, w, proc_h, rect, clip)
@@ -570,16 +802,6 @@ def draw_processes_recursively(ctx, proc, proc_tree, y, proc_h, rect, clip, exit
 		exit_proc_pos['y'] = y
 		exit_proc_pos['h'] = proc_h
 
-	next_y = y + proc_h
-	for child in proc.child_list:
-		if next_y > clip[1] + clip[3]:
-			break
-		child_x, child_y = draw_processes_recursively(ctx, child, proc_tree, next_y, proc_h, rect, clip, exit_proc_pos)
-		draw_process_connecting_lines(ctx, x, y, child_x, child_y, proc_h)
-		next_y = next_y + proc_h * proc_tree.num_nodes([child])
-
-	return x, y
-
 
 def draw_process_activity_colors(ctx, proc, proc_tree, x, y, w, proc_h, rect, clip):
 
@@ -594,11 +816,19 @@ def draw_process_activity_colors(ctx, proc, proc_tree, x, y, w, proc_h, rect, cl
 
 	draw_fill_rect(ctx, base_color, (x, y, w, proc_h))
 
+	# samples are sorted chronologically, so only look at the slice that
+	# can end up within the clip rectangle (with a pixel to spare)
+	samples = proc.samples
+	time_per_px = proc_tree.duration / float(rect[2])
+	first, last = samples.span(
+		proc_tree.start_time + (clip[0] - rect[0] - 1) * time_per_px,
+		proc_tree.start_time + (clip[0] + clip[2] - rect[0] + 1) * time_per_px)
+	times, states, user, sys = samples.time, samples.state, samples.user, samples.sys
+
 	last_tx = -1
-	for sample in proc.samples :
-		tx = rect[0] + round(((sample.time - proc_tree.start_time) * rect[2] / proc_tree.duration))
+	for i in range(first, last):
+		tx = rect[0] + round(((times[i] - proc_tree.start_time) * rect[2] / proc_tree.duration))
 
-		# samples are sorted chronologically
 		if tx < clip[0]:
 			continue
 		if tx > clip[0] + clip[2]:
@@ -611,11 +841,11 @@ def draw_process_activity_colors(ctx, proc, proc_tree, x, y, w, proc_h, rect, cl
 		tw = max (tw, 1) # nice to see at least something
 
 		last_tx = tx + tw
-		state = get_proc_state( sample.state )
+		state = PROC_STATE_CODES.get(states[i], STATE_UNDEFINED)
 
 		color = STATE_COLORS[state]
 		if state == STATE_RUNNING:
-			alpha = min (sample.cpu_sample.user + sample.cpu_sample.sys, 1.0)
+			alpha = min (user[i] + sys[i], 1.0)
 			color = tuple(list(PROC_COLOR_R[0:3]) + [alpha])
 #			print "render time %d [ tx %d tw %d ], sample state %s color %s alpha %g" % (sample.time, tx, tw, state, color, alpha)
 		elif state == STATE_SLEEPING:
@@ -706,13 +936,12 @@ def elide_bootchart(proc):
 class CumlSample:
 	def __init__(self, proc):
 		self.cmd = proc.cmd
-		self.samples = []
+		self.samples = ProcessSamples()
 		self.merge_samples (proc)
 		self.color = None
 
-	def merge_samples(self, proc):
-		self.samples.extend (proc.samples)
-		self.samples.sort (key = lambda p: p.time)
+	def merge_samples(self, *procs):
+		self.samples.merge (*[proc.samples for proc in procs])
 
 	def next(self):
 		global palette_idx
@@ -736,32 +965,32 @@ def draw_cuml_graph(ctx, proc_tree, chart_bounds, duration, sec_w, stat_type):
 	global palette_idx
 	palette_idx = 0
 
-	time_hash = {}
+	time_set = set()
 	total_time = 0.0
 	m_proc_list = {}
+	cmd_procs = {}
 
 	if stat_type is STAT_TYPE_CPU:
 		sample_value = 'cpu'
 	else:
 		sample_value = 'io'
+	total_value = sample_value + '_total'
 	for proc in proc_tree.process_list:
 		if elide_bootchart(proc):
 			continue
 
-		for sample in proc.samples:
-			total_time += getattr(sample.cpu_sample, sample_value)
-			if not sample.time in time_hash:
-				time_hash[sample.time] = 1
+		total_time += getattr(proc, total_value)
+		time_set.update(proc.samples.time)
 
-		# merge pids with the same cmd
-		if not proc.cmd in m_proc_list:
-			m_proc_list[proc.cmd] = CumlSample (proc)
-			continue
-		s = m_proc_list[proc.cmd]
-		s.merge_samples (proc)
+		cmd_procs.setdefault(proc.cmd, []).append(proc)
+
+	# merge pids with the same cmd
+	for cmd, procs in cmd_procs.items():
+		m_proc_list[cmd] = CumlSample (procs[0])
+		m_proc_list[cmd].merge_samples (*procs[1:])
 
 	# all the sample times
-	times = sorted(time_hash)
+	times = sorted(time_set)
 	if len (times) < 2 or total_time == 0:
 		global _warned_degenerate
 		if not _warned_degenerate:
@@ -789,13 +1018,9 @@ def draw_cuml_graph(ctx, proc_tree, chart_bounds, duration, sec_w, stat_type):
 
 	# render each pid in order
 	for cs in m_proc_list.values():
-		row = {}
-		cuml = 0.0
-
-		# print "pid : %s -> %g samples %d" % (proc.cmd, cuml, len (cs.samples))
-		for sample in cs.samples:
-			cuml += getattr(sample.cpu_sample, sample_value)
-			row[sample.time] = cuml
+		cumulative = list(itertools.accumulate(getattr(cs.samples, sample_value)))
+		row = dict(zip(cs.samples.time, cumulative))
+		cuml = cumulative[-1] if cumulative else 0.0
 
 		process_total_time = cuml
 
@@ -15,6 +15,7 @@
 
 import signal
 import math
+import cairo
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk as gtk
@@ -22,8 +23,10 @@ from gi.repository import Gtk
 from gi.repository import Gdk
 from gi.repository import GObject as gobject
 from gi.repository import GObject
+from gi.repository import GLib
 
 from . import draw
+from . import tiles
 from .draw import RenderOptions
 from . import get_version
 
@@ -78,6 +81,13 @@ class PyBootchartWidget(gtk.DrawingArea, gtk.Scrollable):
 
         self.chart_width, self.chart_height = draw.extents(self.options, self.xscale, self.trace)
         self.our_width, self.our_height = self.chart_width, self.chart_height
+        # for working out the chart layout outside of drawing
+        self.measure_ctx = cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1))
+        tile_cache = getattr(options.app_options, 'tile_cache', 64)
+        self.tiles = tiles.TileCache(trace, tile_cache * 1024 * 1024)
+        # render the tiles in the background, redrawing as they come in
+        self.tiles.start(lambda: GLib.idle_add(self.on_tile_rendered))
+        self.connect("destroy", lambda widget: self.tiles.shutdown())
 
         # Use the GObject properties for adjustments to work with Scrollable
         self.hadj = self.get_hadjustment()
@@ -103,17 +113,22 @@ class PyBootchartWidget(gtk.DrawingArea, gtk.Scrollable):
         self.y = min(max(0, max_y), self.y)
 
     def on_draw(self, darea, cr):
-        # set a clip region
-        #cr.rectangle(
-        #        self.x, self.y,
-        #        self.chart_width, self.chart_height
-        #)
-        #cr.clip()
         cr.set_source_rgba(1.0, 1.0, 1.0, 1.0)
         cr.paint()
-        cr.scale(self.zoom_ratio, self.zoom_ratio)
-        cr.translate(-self.x, -self.y)
-        draw.render(cr, self.options, self.xscale, self.trace)
+        # blit the pre-rendered tiles, queueing those not seen before
+        allocation = self.get_allocation()
+        self.tiles.paint(cr, self.options, self.xscale, self.zoom_ratio,
+                         self.x, self.y, allocation.width, allocation.height)
+
+    def on_tile_rendered(self):
+        # the tile may come in after the widget is gone
+        if self.tiles.executor is not None:
+            self.queue_draw()
+        return False
+
+    def chart_layout(self):
+        """The ChartLayout of what the widget draws, shared with rendering"""
+        return draw.chart_layout(self.measure_ctx, self.options, self.xscale, self.trace)
 
     def position_changed(self):
         self.emit("position-changed", self.x, self.y)
@@ -294,8 +309,35 @@ class PyBootchartWidget(gtk.DrawingArea, gtk.Scrollable):
             self.prevmousex = x
             self.prevmousey = y
             self.position_changed()
+        else:
+            self.set_tooltip_text(self.describe_at(self.x + event.x / self.zoom_ratio,
+                                                   self.y + event.y / self.zoom_ratio))
         return True
 
+    BUSIEST = 3
+
+    def describe_at(self, x, y):
+        """Describes the process under x, y of the chart, and the busiest
+        processes at that time, or returns None outside the process tree."""
+        layout = self.chart_layout()
+        if layout.row_at(y) is None:
+            return None
+        lines = []
+        proc = layout.proc_at(x, y)
+        if proc is not None:
+            lines.append("%s [%d]\nstarted %.2fs, ran %.2fs" %
+                         (proc.cmd, proc.pid // 1000, proc.start_time / 100.0, proc.duration / 100.0))
+        proc_tree = layout.proc_tree
+        time = layout.time_at(x)
+        # the sample period around the pointer
+        start, end = time - proc_tree.sample_period / 2, time + proc_tree.sample_period / 2
+        index = proc_tree.lifetimes()
+        busiest = ["%s (%d%%)" % (p.cmd, round(100 * index.cpu(p, start, end)))
+                   for p in index.top_cpu(start, end, self.BUSIEST) if index.cpu(p, start, end) > 0]
+        if busiest:
+            lines.append("busiest at %.2fs: %s" % (time / 100.0, ", ".join(busiest)))
+        return "\n".join(lines) or None
+
     def on_allocation_size_changed(self, widget, allocation):
         if allocation.width > 0 and allocation.height > 0:
             # Check if size actually changed to avoid unnecessary updates
@@ -514,31 +556,17 @@ class PyBootchartShell(gtk.VBox):
         # Redraw to highlight matches
         self.widget2.queue_draw()
 
+    def matching_processes(self, search_text):
+        """Return the set of pids of the processes matching the search query"""
+        return self.trace.search(search_text, self.widget2.options.kernel_only)
+
     def count_matches(self, search_text):
         """Count how many processes match the search query"""
         count = 0
         proc_tree = self.widget2.options.proc_tree(self.trace)
         if proc_tree and proc_tree.process_tree:
-            count = self._count_matches_recursive(proc_tree.process_tree, search_text)
-        return count
-
-    def _count_matches_recursive(self, process_list, search_text):
-        """Recursively count matches in process tree"""
-        count = 0
-        for proc in process_list:
-            # Check if process matches
-            if search_text in proc.cmd.lower():
-                count += 1
-            elif proc.exe and search_text in proc.exe.lower():
-                count += 1
-            elif proc.args:
-                for arg in proc.args:
-                    if search_text in arg.lower():
-                        count += 1
-                        break
-            # Check children
-            if proc.child_list:
-                count += self._count_matches_recursive(proc.child_list, search_text)
+            matches = self.matching_processes(search_text)
+            count = sum(1 for proc in proc_tree.rows if proc.pid in matches)
         return count
 
     def scroll_to_first_match(self, search_text):
@@ -547,22 +575,9 @@ class PyBootchartShell(gtk.VBox):
         if not proc_tree or not proc_tree.process_tree:
             return
 
-        # Constants from draw.py
-        proc_h = 16  # Height of each process bar
-
-        # Estimate starting Y position for processes
-        # This needs to account for: header + charts (if shown) + process chart header
-        # Rough estimates: header ~= 60-80px, charts (if enabled) ~= 200-300px
-        # Process chart header = 60px
-        if self.widget2.options.charts:
-            # With charts enabled (default)
-            start_y = 350  # Approximate: header + CPU chart + disk chart + mem chart + proc header
-        else:
-            # Charts disabled
-            start_y = 120  # Approximate: header + proc header
-
         # Find Y position of first match (in chart coordinates)
-        y_pos = self._find_first_match_position(proc_tree.process_tree, search_text, start_y, proc_h, proc_tree)
+        matches = self.matching_processes(search_text)
+        y_pos = self._find_first_match_position(matches, self.widget2.chart_layout())
 
         if y_pos is not None:
             # Convert from chart coordinates to screen coordinates
@@ -581,29 +596,11 @@ class PyBootchartShell(gtk.VBox):
 
             vadj.set_value(scroll_pos)
 
-    def _find_first_match_position(self, process_list, search_text, current_y, proc_h, proc_tree):
-        """Recursively find Y position of first matching process"""
-        for proc in process_list:
-            # Check if this process matches
-            if search_text in proc.cmd.lower():
-                return current_y
-            elif proc.exe and search_text in proc.exe.lower():
-                return current_y
-            elif proc.args:
-                for arg in proc.args:
-                    if search_text in arg.lower():
-                        return current_y
-
-            # Check children
-            if proc.child_list:
-                child_y = current_y + proc_h
-                result = self._find_first_match_position(proc.child_list, search_text, child_y, proc_h, proc_tree)
-                if result is not None:
-                    return result
-
-            # Move to next sibling
-            current_y += proc_h * proc_tree.num_nodes([proc])
-
+    def _find_first_match_position(self, matches, layout):
+        """Find Y position of first matching process"""
+        for row, proc in enumerate(layout.proc_tree.rows):
+            if proc.pid in matches:
+                return layout.row_y(row)
         return None
 
     def build_match_list(self, search_text):
@@ -613,43 +610,11 @@ class PyBootchartShell(gtk.VBox):
         if not proc_tree or not proc_tree.process_tree:
             return
 
-        # Constants from draw.py
-        proc_h = 16
-
-        # Estimate starting Y position
-        if self.widget2.options.charts:
-            start_y = 350
-        else:
-            start_y = 120
-
-        # Collect all matches
-        self._collect_matches_recursive(proc_tree.process_tree, search_text, start_y, proc_h, proc_tree)
-
-    def _collect_matches_recursive(self, process_list, search_text, current_y, proc_h, proc_tree):
-        """Recursively collect all matching processes"""
-        for proc in process_list:
-            # Check if this process matches
-            matches = False
-            if search_text in proc.cmd.lower():
-                matches = True
-            elif proc.exe and search_text in proc.exe.lower():
-                matches = True
-            elif proc.args:
-                for arg in proc.args:
-                    if search_text in arg.lower():
-                        matches = True
-                        break
-
-            if matches:
-                self.search_matches.append(current_y)
-
-            # Check children
-            if proc.child_list:
-                child_y = current_y + proc_h
-                self._collect_matches_recursive(proc.child_list, search_text, child_y, proc_h, proc_tree)
-
-            # Move to next sibling
-            current_y += proc_h * proc_tree.num_nodes([proc])
+        # Collect all matches, at the rows they are drawn in
+        matches = self.matching_processes(search_text)
+        layout = self.widget2.chart_layout()
+        self.search_matches = [layout.row_y(row)
+                               for row, proc in enumerate(proc_tree.rows) if proc.pid in matches]
 
     def scroll_to_match(self, match_index):
         """Scroll to show the match at the given index"""
@@ -996,7 +961,7 @@ class PyBootchartWindow(gtk.Window):
             filename = dialog.get_filename()
             dialog.destroy()
             # Reload the window with new file
-            from . import parsing
+            from . import cache
 
             class Writer:
                 def error(self, msg): print(msg)
@@ -1006,7 +971,7 @@ class PyBootchartWindow(gtk.Window):
 
             try:
                 writer = Writer()
-                trace = parsing.Trace(writer, [filename], self.app_options)
+                trace = cache.load_trace(writer, [filename], self.app_options)
                 self.destroy()
                 win = PyBootchartWindow(trace, self.app_options)
                 win.connect('destroy', gtk.main_quit)
@@ -1187,22 +1152,22 @@ class PyBootchartWindow(gtk.Window):
     def on_toggle_prune_procs(self, action):
         # Update prune option
         self.app_options.prune = action.get_active()
-        # Reload trace with new prune setting
-        self.reload_trace()
+        # Switch to the process tree for the new prune setting
+        self.update_view()
 
     def on_toggle_show_kernel(self, action):
         # Update show_kernel option
         self.app_options.show_kernel = action.get_active()
-        # Reload trace with new show_kernel setting
-        self.reload_trace()
+        # Switch to the process tree for the new show_kernel setting
+        self.update_view()
 
     def on_sort_changed(self, action, current):
         # Map radio action values to sort strategy strings
         sort_map = {0: 'pid', 1: 'start-time', 2: 'cpu-time', 3: 'end-time'}
         sort_value = current.get_current_value()
         self.app_options.proc_sort = sort_map.get(sort_value, 'pid')
-        # Reload trace with new sort setting
-        self.reload_trace()
+        # Switch to the process tree for the new sort setting
+        self.update_view()
 
     def on_toggle_tabs(self, action):
         # Toggle visibility of tab bar
@@ -1228,25 +1193,16 @@ class PyBootchartWindow(gtk.Window):
         if action:
             action.set_active(active)
 
-    def reload_trace(self):
-        """Reload the trace with current app_options (e.g., after changing prune setting)"""
-        from . import parsing
+    def update_view(self):
+        """Show the process trees for the current app_options (e.g., after
+        changing prune setting).  They are derived from the trace in memory,
+        without reading the bootchart again."""
+        trace = self.trace
+        trace.set_view(self.app_options.prune,
+                       getattr(self.app_options, 'show_kernel', True),
+                       getattr(self.app_options, 'proc_sort', 'start-time'))
 
-        class Writer:
-            def error(self, msg): print(msg)
-            def warn(self, msg): print(msg)
-            def info(self, msg): print(msg)
-            def status(self, msg): print(msg)
-
-        writer = Writer()
-        # Re-parse with new options
-        new_trace = parsing.Trace(writer, [self.trace.filename], self.app_options)
-        self.trace = new_trace
-
-        # Update window title
-        self.set_title("Bootchart %s" % new_trace.filename)
-
-        # Recreate all tabs with new trace
+        # Recreate all tabs with the new trees
         # Remove old tabs from notebook
         while self.tab_page.get_n_pages() > 0:
             self.tab_page.remove_page(0)
@@ -1254,16 +1210,16 @@ class PyBootchartWindow(gtk.Window):
 
         # Recreate tabs
         full_opts = draw.RenderOptions(self.app_options)
-        full_tree = PyBootchartShell(self, new_trace, full_opts, 5.0)
+        full_tree = PyBootchartShell(self, trace, full_opts, 5.0)
         self.tab_page.append_page(full_tree, gtk.Label("Full tree"))
         self.tabs = [full_tree]
 
-        if new_trace.kernel is not None and len(new_trace.kernel) > 2:
+        if trace.kernel is not None and len(trace.kernel) > 2:
             kernel_opts = draw.RenderOptions(self.app_options)
             kernel_opts.cumulative = False
             kernel_opts.charts = False
             kernel_opts.kernel_only = True
-            kernel_tree = PyBootchartShell(self, new_trace, kernel_opts, 5.0)
+            kernel_tree = PyBootchartShell(self, trace, kernel_opts, 5.0)
             self.tab_page.append_page(kernel_tree, gtk.Label("Kernel boot"))
             self.tabs.append(kernel_tree)
 
@@ -14,7 +14,9 @@
 #  along with initviz. If not, see <http://www.gnu.org/licenses/>.
 
 
+import bisect
 import codecs
+import concurrent.futures
 import functools
 import io
 import itertools
@@ -27,7 +29,7 @@ try:
     from time import perf_counter
 except ImportError:
     from time import clock as perf_counter
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from functools import reduce
 
 from .samples import *
@@ -39,7 +41,11 @@ if sys.version_info >= (3, 0):
 # Parsing produces as its end result a 'Trace'
 
 class Trace:
+    # how many process tree views to keep around, see set_view()
+    MAX_VIEWS = 8
+
     def __init__(self, writer, paths, options):
+        self.writer = writer
         self.headers = None
         self.disk_stats = None
         self.ps_stats = None
@@ -54,8 +60,12 @@ class Trace:
         self.boot_time = None  # Time when EXIT_PROC was detected
         self.exit_proc_pid = None  # PID of the EXIT_PROC process
         self.exit_proc_comm = None  # Command name of the EXIT_PROC process
+        self.process_index = None
+        self.kernel_index = None
+        self.search_index = None
+        self.views = OrderedDict()
 
-        parse_paths (writer, self, paths)
+        parse_paths (writer, self, paths, getattr(options, 'jobs', 1))
         if not self.valid():
             raise ParseError("empty state: '%s' does not contain a valid bootchart" % ", ".join(paths))
 
@@ -66,7 +76,9 @@ class Trace:
         # Crop the chart to the end of the first idle period after the given
         # process
         if options.crop_after:
-            idle = self.crop (writer, options.crop_after)
+            idle = self.crop (writer, options.crop_after,
+                              getattr(options, 'crop_idle_threshold', 0.25),
+                              int(round(getattr(options, 'crop_idle_window', 3.0) * 100)))
         else:
             idle = None
 
@@ -74,53 +86,104 @@ class Trace:
         self.times = [ idle ]
         if options.annotate:
             for procnames in options.annotate:
-                names = [x[:15] for x in procnames.split(",")]
-                for proc in self.ps_stats.process_map.values():
-                    if proc.cmd in names:
-                        self.times.append(proc.start_time)
-                        break
-                    else:
-                        self.times.append(None)
-
-        proc_sort = getattr(options, 'proc_sort', 'start-time')
-        show_kernel = getattr(options, 'show_kernel', True)
-        self.proc_tree = ProcessTree(writer, self.kernel, self.ps_stats,
-                                     self.ps_stats.sample_period,
-                                     self.headers.get("profile.process"),
-                                     options.prune, idle, self.taskstats,
-                                     self.parent_map is not None,
-                                     self.boot_time, False, proc_sort,
-                                     self.exit_proc_pid, self.exit_proc_comm,
-                                     show_kernel)
-
+                self.times.append(self.first_start(procnames.split(",")))
+
+        self.idle = idle
+        self.sibling_merge = getattr(options, 'sibling_merge', 'adjacent')
+        self.passes = getattr(options, 'passes', None)
+        self.only_subtree = _names(getattr(options, 'only_subtree', None))
+        self.exclude_subtree = _names(getattr(options, 'exclude_subtree', None))
+        # the full tree also holds the kernel processes
+        self.search_index = self.process_index
         if self.kernel is not None:
-            self.kernel_tree = ProcessTree(writer, self.kernel, None, 0,
-                                           self.headers.get("profile.process"),
-                                           False, None, None, True, None, False, proc_sort)
+            self.kernel_index = ProcessIndex(self.kernel)
+            self.search_index = ProcessIndex(list(self.kernel) + list(self.ps_stats.process_map.values()))
+        self.set_view(options.prune, getattr(options, 'show_kernel', True),
+                      getattr(options, 'proc_sort', 'start-time'))
+
+    def set_view(self, prune, show_kernel, proc_sort):
+        """Switch proc_tree and kernel_tree to the given pruning, kernel
+           thread and sorting settings.  The trees are built from the
+           compiled processes, which they leave untouched, and the most
+           recently used ones are kept for switching back."""
+        key = (bool(prune), bool(show_kernel), proc_sort)
+        if key in self.views:
+            self.views.move_to_end(key)
+        else:
+            self.views[key] = self._build_view(prune, show_kernel, proc_sort)
+            while len(self.views) > self.MAX_VIEWS:
+                self.views.popitem(last=False)
+        self.proc_tree, self.kernel_tree = self.views[key]
+
+    def _build_view(self, prune, show_kernel, proc_sort):
+        proc_tree = ProcessTree(self.writer, self.kernel, self.ps_stats,
+                                self.ps_stats.sample_period,
+                                self.headers.get("profile.process"),
+                                prune, self.idle, self.taskstats,
+                                self.parent_map is not None,
+                                self.boot_time, False, proc_sort,
+                                self.exit_proc_pid, self.exit_proc_comm,
+                                show_kernel, self.sibling_merge, self.passes)
+        if self.only_subtree or self.exclude_subtree:
+            removed = proc_tree.filter_subtrees(self.only_subtree, self.exclude_subtree)
+            self.writer.status("filtered out %i processes" % removed)
+        kernel_tree = None
+        if self.kernel is not None:
+            kernel_tree = ProcessTree(self.writer, self.kernel, None, 0,
+                                      self.headers.get("profile.process"),
+                                      False, None, None, True, None, False, proc_sort)
+        return proc_tree, kernel_tree
 
     def valid(self):
         return self.headers != None and self.disk_stats != None and \
                self.ps_stats != None and self.cpu_stats != None
 
+    def find_processes(self, name):
+        """Returns the processes whose cmd or exe is name, ordered by start time."""
+        return self.process_index.lookup(name)
+
+    def search(self, text, kernel_only=False):
+        """Returns the pids of the processes whose cmd, exe or one of the
+           args contains text, ignoring case, among those of the kernel tree
+           or of the full tree.  The trees hold copies of the processes,
+           hence the pids."""
+        index = self.kernel_index if kernel_only else self.search_index
+        if index is None:
+            return set()
+        return set(proc.pid for proc in index.search(text))
+
+    def first_start(self, names):
+        """Returns the time the first process called any of names started,
+           or None if there is no such process."""
+        proc = self.process_index.first(names)
+        return proc.start_time if proc is not None else None
 
     def compile(self, writer):
 
+        # resolved parent of every pid visited so far
+        parent_ids = {0: 0}
+
         def find_parent_id_for(pid):
-            if pid == 0:
-                return 0
-            ppid = self.parent_map.get(pid)
-            if ppid:
-                # many of these double forks are so short lived
-                # that we have no samples, or process info for them
-                # so climb the parent hierarcy to find one
-                if int (ppid * 1000) not in self.ps_stats.process_map:
-#                    print "Pid '%d' short lived with no process" % ppid
-                    ppid = find_parent_id_for (ppid)
-#                else:
-#                    print "Pid '%d' has an entry" % ppid
+            # many of these double forks are so short lived
+            # that we have no samples, or process info for them
+            # so climb the parent hierarchy to find one, then
+            # remember the answer for every pid on the way
+            path = set()
+            while pid not in parent_ids:
+                ppid = self.parent_map.get(pid)
+                if not ppid or ppid in path:
+                    # missing from the pid map, or a loop
+                    ppid = 0
+                    break
+                if int (ppid * 1000) in self.ps_stats.process_map:
+                    break
+                path.add(pid)
+                pid = ppid
             else:
-#                print "Pid '%d' missing from pid map" % pid
-                return 0
+                ppid = parent_ids[pid]
+            parent_ids[pid] = ppid
+            for p in path:
+                parent_ids[p] = ppid
             return ppid
 
         # merge in the cmdline data
@@ -148,58 +211,39 @@ class Trace:
         # count on fingers variously
         for process in self.ps_stats.process_map.values():
             process.calc_stats (self.ps_stats.sample_period)
+            process.discard_parse_state()
 
-    def crop(self, writer, crop_after):
-
-        def is_idle_at(util, start, j):
-            k = j + 1
-            while k < len(util) and util[k][0] < start + 300:
-                k += 1
-            k = min(k, len(util)-1)
-
-            if util[j][1] >= 0.25:
-                return False
+        self.process_index = ProcessIndex(self.ps_stats.process_map.values())
 
-            avgload = sum(u[1] for u in util[j:k+1]) / (k-j+1)
-            if avgload < 0.25:
-                return True
-            else:
-                return False
-        def is_idle(util, start):
-            for j in range(0, len(util)):
-                if util[j][0] < start:
-                    continue
-                return is_idle_at(util, start, j)
-            else:
-                return False
+    def crop(self, writer, crop_after, idle_threshold=0.25, idle_window=300):
+        """Crop the chart idle_window (in 1/100s) after the system first goes
+           idle once a process named in crop_after has started.  The system
+           is idle when both the cpu and the disk utilization are below
+           idle_threshold, and stay so on average over idle_window."""
 
-        names = [x[:15] for x in crop_after.split(",")]
-        for proc in self.ps_stats.process_map.values():
-            if proc.cmd in names or proc.exe in names:
-                writer.info("selected proc '%s' from list (start %d)"
-                            % (proc.cmd, proc.start_time))
-                break
+        proc = self.process_index.first(crop_after.split(","))
         if proc is None:
             writer.warn("no selected crop proc '%s' in list" % crop_after)
+            return None
+        writer.info("selected proc '%s' from list (start %d)"
+                    % (proc.cmd, proc.start_time))
 
-
-        cpu_util = [(sample.time, sample.user + sample.sys + sample.io) for sample in self.cpu_stats]
-        disk_util = [(sample.time, sample.util) for sample in self.disk_stats]
+        cpu_util = _UtilSeries([(sample.time, sample.user + sample.sys + sample.io) for sample in self.cpu_stats])
+        disk_util = _UtilSeries([(sample.time, sample.util) for sample in self.disk_stats])
 
         idle = None
-        for i in range(0, len(cpu_util)):
-            if cpu_util[i][0] < proc.start_time:
-                continue
-            if is_idle_at(cpu_util, cpu_util[i][0], i) \
-               and is_idle(disk_util, cpu_util[i][0]):
-                idle = cpu_util[i][0]
+        for i in range(cpu_util.index(proc.start_time), len(cpu_util)):
+            start = cpu_util.times[i]
+            if cpu_util.is_idle_at(i, start, idle_window, idle_threshold) \
+               and disk_util.is_idle(start, idle_window, idle_threshold):
+                idle = start
                 break
 
         if idle is None:
             writer.warn ("not idle after proc '%s'" % crop_after)
             return None
 
-        crop_at = idle + 300
+        crop_at = idle + idle_window
         writer.info ("cropping at time %d" % crop_at)
         while len (self.cpu_stats) \
                     and self.cpu_stats[-1].time > crop_at:
@@ -217,16 +261,51 @@ class Trace:
 
         for proc in cropped_map.values():
             proc.duration = min (proc.duration, crop_at - proc.start_time)
-            while len (proc.samples) \
-                        and proc.samples[-1].time > crop_at:
-                proc.samples.pop()
+            proc.samples.crop(crop_at)
+            proc.calc_totals()
 
         self.ps_stats.process_map = cropped_map
+        self.process_index = ProcessIndex(cropped_map.values())
 
         return idle
 
 
 
+def _names(names):
+    """Splits a comma separated list of process names, None stays None."""
+    if names is None:
+        return None
+    return [name for name in names.split(",") if name]
+
+class _UtilSeries:
+    """A utilization time series, with prefix sums for window averages."""
+    def __init__(self, util):
+        self.times = [u[0] for u in util]
+        self.values = [u[1] for u in util]
+        self.sums = [0.0]
+        self.sums.extend(itertools.accumulate(self.values))
+
+    def __len__(self):
+        return len(self.times)
+
+    def index(self, time):
+        """Returns the index of the first sample at or after time."""
+        return bisect.bisect_left(self.times, time)
+
+    def is_idle_at(self, j, start, window, threshold):
+        if self.values[j] >= threshold:
+            return False
+        # the window covers sample j up to and including the first
+        # sample at or after start + window
+        k = min(bisect.bisect_left(self.times, start + window, j + 1), len(self.times) - 1)
+        return (self.sums[k+1] - self.sums[j]) / (k-j+1) < threshold
+
+    def is_idle(self, start, window, threshold):
+        j = self.index(start)
+        if j == len(self.times):
+            return False
+        return self.is_idle_at(j, start, window, threshold)
+
 class ParseError(Exception):
     """Represents errors during parse of the bootchart."""
     def __init__(self, value):
@@ -264,28 +343,37 @@ def _iter_parse_timed_blocks(file):
             return (int(lines[0]), lines[1:])
         except ValueError:
             raise ParseError("expected a timed-block, but timestamp '%s' is not an integer" % lines[0])
-    # File is already a text stream in Python 3
-    data = file
-    block = [line.strip() for line in itertools.takewhile(lambda s: s != "\n", data)]
-    while block:
-        if block and not block[-1].endswith(" not running\n"):
+    # File is already a text stream in Python 3, read it line by line
+    block = []
+    for line in file:
+        line = line.strip()
+        if line:
+            block.append(line)
+            continue
+        # an empty line terminates the block, runs of them are skipped
+        if block and not block[-1].endswith(" not running"):
             yield parse(block)
-        block = [line.strip() for line in itertools.takewhile(lambda s: s != "\n", data)]
+        block = []
+    if block and not block[-1].endswith(" not running"):
+        yield parse(block)
 
-def _parse_timed_blocks(file):
-    """Parses (ie., splits) a file into so-called timed-blocks. A
-    timed-block consists of a timestamp on a line by itself followed
-    by zero or more lines of data for that point in time."""
-    def parse(block):
-        lines = block.split('\n')
-        if not lines:
-            raise ParseError('expected a timed-block consisting a timestamp followed by data lines')
-        try:
-            return (int(lines[0]), lines[1:])
-        except ValueError:
-            raise ParseError("expected a timed-block, but timestamp '%s' is not an integer" % lines[0])
-    blocks = file.read().split('\n\n')
-    return [parse(block) for block in blocks if block.strip() and not block.endswith(' not running\n')]
+def _parse_proc_ps_line(line):
+    """Split a /proc/<pid>/stat line into the fields used by the chart.
+
+    Returns (pid, comm, state, ppid, utime, stime, starttime), or None for
+    a truncated line.  comm is delimited by the first blank and the last
+    ')' on the line, since it may contain both itself.
+    """
+    sep = line.find(' ')
+    end = line.rfind(')')
+    if sep < 0 or end < sep:
+        return None
+    # the 20 fields following comm, up to starttime
+    fields = line[end+2:].split(' ', 20)
+    if len(fields) < 20:
+        return None
+    return int(line[:sep]), line[sep+1:end+1].strip('()'), fields[0], int(fields[1]), \
+        int(fields[11]), int(fields[12]), int(fields[19])
 
 def _parse_proc_ps_log(writer, file):
     """
@@ -309,22 +397,19 @@ def _parse_proc_ps_log(writer, file):
         timed_blocks_count += 1
         for line in lines:
             if not line: continue
-            tokens = line.split(' ')
-            if len(tokens) < 21:
+            fields = _parse_proc_ps_line(line)
+            if fields is None:
                 continue
-
-            offset = [index for index, token in enumerate(tokens[1:]) if token[-1] == ')'][0]
-            pid, cmd, state, ppid = int(tokens[0]), ' '.join(tokens[1:2+offset]), tokens[2+offset], int(tokens[3+offset])
-            userCpu, sysCpu, stime = int(tokens[13+offset]), int(tokens[14+offset]), int(tokens[21+offset])
+            pid, cmd, state, ppid, userCpu, sysCpu, stime = fields
 
             # magic fixed point-ness ...
             pid *= 1000
             ppid *= 1000
             if pid in processMap:
                 process = processMap[pid]
-                process.cmd = cmd.strip('()') # why rename after latest name??
+                process.cmd = cmd # why rename after latest name??
             else:
-                process = Process(writer, pid, cmd.strip('()'), ppid, min(time, stime))
+                process = Process(writer, pid, cmd, ppid, min(time, stime))
                 processMap[pid] = process
 
             if process.last_user_cpu_time is not None and process.last_sys_cpu_time is not None:
@@ -332,8 +417,7 @@ def _parse_proc_ps_log(writer, file):
                     userCpuLoad, sysCpuLoad = 0, 0
                 else:
                     userCpuLoad, sysCpuLoad = process.calc_load(userCpu, sysCpu, max(1, time - ltime))
-                cpuSample = CPUSample('null', userCpuLoad, sysCpuLoad, 0.0)
-                process.samples.append(ProcessSample(time, state, cpuSample))
+                process.samples.add(time, state, userCpuLoad, sysCpuLoad)
 
             process.last_user_cpu_time = userCpu
             process.last_sys_cpu_time = sysCpu
@@ -356,13 +440,16 @@ def _parse_taskstats_log(writer, file):
     processMap = {}
     pidRewrites = {}
     ltime = None
-    timed_blocks = _parse_timed_blocks(file)
-    for time, lines in timed_blocks:
+    startTime = None
+    timed_blocks_count = 0
+    for time, lines in _iter_parse_timed_blocks(file):
+        timed_blocks_count += 1
         # we have no 'stime' from taskstats, so prep 'init'
         if ltime is None:
             process = Process(writer, 1, '[init]', 0, 0)
             processMap[1000] = process
             ltime = time
+            startTime = time
 #                       continue
         for line in lines:
             if not line: continue
@@ -410,32 +497,30 @@ def _parse_taskstats_log(writer, file):
             else:
                 state = "S"
 
-            # retain the ns timing information into a CPUSample - that tries
+            # retain the ns timing information into a sample - that tries
             # with the old-style to be a %age of CPU used in this time-slice.
             if delta_cpu_ns + delta_blkio_delay_ns + delta_swapin_delay_ns > 0:
 #                               print "proc %s cpu_ns %g delta_cpu %g" % (cmd, cpu_ns, delta_cpu_ns)
-                cpuSample = CPUSample('null', delta_cpu_ns, 0.0,
-                                      delta_blkio_delay_ns,
-                                      delta_swapin_delay_ns)
-                process.samples.append(ProcessSample(time, state, cpuSample))
+                process.samples.add(time, state, delta_cpu_ns, 0.0,
+                                    delta_blkio_delay_ns,
+                                    delta_swapin_delay_ns)
 
             process.last_cpu_ns = cpu_ns
             process.last_blkio_delay_ns = blkio_delay_ns
             process.last_swapin_delay_ns = swapin_delay_ns
         ltime = time
 
-    if len (timed_blocks) < 2:
+    if timed_blocks_count < 2:
         return None
 
-    startTime = timed_blocks[0][0]
-    avgSampleLength = (ltime - startTime)/(len(timed_blocks)-1)
+    avgSampleLength = (ltime - startTime)/(timed_blocks_count - 1)
 
-    return ProcessStats (writer, processMap, len (timed_blocks), avgSampleLength, startTime, ltime)
+    return ProcessStats (writer, processMap, timed_blocks_count, avgSampleLength, startTime, ltime)
 
 def _parse_proc_stat_log(file):
     samples = []
     ltimes = None
-    for time, lines in _parse_timed_blocks(file):
+    for time, lines in _iter_parse_timed_blocks(file):
         # skip emtpy lines
         if not lines:
             continue
@@ -472,20 +557,22 @@ def _parse_proc_disk_stat_log(file, numCpu):
         disk = linetokens[2]
         return disk_regex_re.match(disk)
 
-    disk_stat_samples = []
+    disk_stats = []
+    sample1 = None
 
-    for time, lines in _parse_timed_blocks(file):
-        sample = DiskStatSample(time)
+    for time, lines in _iter_parse_timed_blocks(file):
+        sample2 = DiskStatSample(time)
         relevant_tokens = [linetokens for linetokens in map (lambda x: x.split(),lines) if is_relevant_line(linetokens)]
 
         for tokens in relevant_tokens:
             disk, rsect, wsect, use = tokens[2], int(tokens[5]), int(tokens[9]), int(tokens[12])
-            sample.add_diskdata([rsect, wsect, use])
+            sample2.add_diskdata([rsect, wsect, use])
 
-        disk_stat_samples.append(sample)
+        # only the previous block is needed to compute the deltas
+        if sample1 is None:
+            sample1 = sample2
+            continue
 
-    disk_stats = []
-    for sample1, sample2 in zip(disk_stat_samples[:-1], disk_stat_samples[1:]):
         interval = sample1.time - sample2.time
         if interval == 0:
             interval = 1
@@ -495,6 +582,7 @@ def _parse_proc_disk_stat_log(file, numCpu):
         util = float( sums[2] ) / 10 / interval / numCpu
         util = max(0.0, min(1.0, util))
         disk_stats.append(DiskSample(sample2.time, readTput, writeTput, util))
+        sample1 = sample2
 
     return disk_stats
 
@@ -506,7 +594,7 @@ def _parse_proc_meminfo_log(file):
     mem_stats = []
     meminfo_re = re.compile(r'(MemTotal|MemFree|Buffers|Cached|SwapTotal|SwapFree):\s*(\d+).*')
 
-    for time, lines in _parse_timed_blocks(file):
+    for time, lines in _iter_parse_timed_blocks(file):
         sample = MemSample(time)
 
         for line in lines:
@@ -596,7 +684,7 @@ def _parse_dmesg(writer, file):
         elif type == "async_waiting" or type == "async_continuing":
             continue # ignore
 
-    return processMap.values()
+    return list(processMap.values())
 
 #
 # Parse binary pacct accounting file output if we have one
@@ -691,37 +779,189 @@ def _do_parse(writer, state, name, file):
             if len(parts) >= 2:
                 state.exit_proc_comm = parts[1]
 
-    elif name == "proc_diskstats.log":
-        state.disk_stats = _parse_proc_disk_stat_log(file, get_num_cpus(state.headers))
+    elif name in _LOG_MEMBERS:
+        result = _parse_log(writer, name, file, get_num_cpus(state.headers))
+        _store_log(state, name, result)
+    elif name == "kernel_pacct": # obsoleted by PROC_EVENTS
+        state.parent_map = _parse_pacct(writer, file)
+    t2 = perf_counter()
+    writer.info("  %s seconds" % str(t2-t1))
+    return state
+
+# The logs which can be parsed independently of each other, and the Trace
+# attribute the result of each of them is stored in.
+_LOG_MEMBERS = {
+    "proc_diskstats.log": "disk_stats",
+    "taskstats.log": "ps_stats",
+    "proc_stat.log": "cpu_stats",
+    "proc_meminfo.log": "mem_stats",
+    "dmesg": "kernel",
+    "cmdline2.log": "cmdline",
+    "paternity.log": "parent_map",
+    "proc_ps.log": "ps_stats",  # obsoleted by TASKSTATS
+}
+
+def _parse_log(writer, name, file, num_cpus):
+    if name == "proc_diskstats.log":
+        return _parse_proc_disk_stat_log(file, num_cpus)
     elif name == "taskstats.log":
-        state.ps_stats = _parse_taskstats_log(writer, file)
-        state.taskstats = True
+        return _parse_taskstats_log(writer, file)
     elif name == "proc_stat.log":
-        state.cpu_stats = _parse_proc_stat_log(file)
+        return _parse_proc_stat_log(file)
     elif name == "proc_meminfo.log":
-        state.mem_stats = _parse_proc_meminfo_log(file)
+        return _parse_proc_meminfo_log(file)
     elif name == "dmesg":
-        state.kernel = _parse_dmesg(writer, file)
+        return _parse_dmesg(writer, file)
     elif name == "cmdline2.log":
-        state.cmdline = _parse_cmdline_log(writer, file)
+        return _parse_cmdline_log(writer, file)
     elif name == "paternity.log":
-        state.parent_map = _parse_paternity_log(writer, file)
-    elif name == "proc_ps.log":  # obsoleted by TASKSTATS
-        state.ps_stats = _parse_proc_ps_log(writer, file)
-    elif name == "kernel_pacct": # obsoleted by PROC_EVENTS
-        state.parent_map = _parse_pacct(writer, file)
-    t2 = perf_counter()
-    writer.info("  %s seconds" % str(t2-t1))
-    return state
+        return _parse_paternity_log(writer, file)
+    elif name == "proc_ps.log":
+        return _parse_proc_ps_log(writer, file)
+
+def _store_log(state, name, result):
+    setattr(state, _LOG_MEMBERS[name], result)
+    if name == "taskstats.log":
+        state.taskstats = True
 
-def parse_file(writer, state, filename):
+def _log_processes(name, result):
+    """Returns the processes created while parsing the given log."""
+    if result is None:
+        return []
+    if name in ("taskstats.log", "proc_ps.log"):
+        return result.process_map.values()
+    if name == "dmesg":
+        return result
+    return []
+
+class _DeferredWriter:
+    """Collects the messages of a worker process, so that the real writer
+       can replay them once the result is merged."""
+    def __init__(self):
+        self.messages = []
+
+    def error(self, msg):
+        self.messages.append(("error", msg))
+
+    def warn(self, msg):
+        self.messages.append(("warn", msg))
+
+    def info(self, msg):
+        self.messages.append(("info", msg))
+
+    def status(self, msg):
+        self.messages.append(("status", msg))
+
+    def replay(self, writer):
+        for level, msg in self.messages:
+            getattr(writer, level)(msg)
+
+def _parse_log_job(name, source, num_cpus):
+    """Runs in a worker process: parse a log given by path or raw contents."""
+    writer = _DeferredWriter()
+    t1 = perf_counter()
+    if isinstance(source, bytes):
+        file = io.TextIOWrapper(io.BytesIO(source), encoding='utf-8')
+    else:
+        file = open(source, "r")
+    with file:
+        result = _parse_log(writer, name, file, num_cpus)
+    t2 = perf_counter()
+    writer.info("  %s: %s seconds" % (name, str(t2-t1)))
+    return result, writer
+
+class _LogPool:
+    """Parses the independent logs of a bootchart in a pool of worker
+       processes.  The results are merged into the trace in the order the
+       logs were submitted, so the outcome is the same as when parsing them
+       one after another.
+    """
+    def __init__(self, jobs):
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        self.pending = []
+
+    def submit(self, writer, state, name, source):
+        writer.status("parsing '%s' in the background" % name)
+        future = self.executor.submit(_parse_log_job, name, source,
+                                      get_num_cpus(state.headers))
+        self.pending.append((name, future))
+
+    def merge(self, writer, state):
+        for name, future in self.pending:
+            result, job_writer = future.result()
+            job_writer.replay(writer)
+            for proc in _log_processes(name, result):
+                proc.writer = writer
+            _store_log(state, name, result)
+        self.pending = []
+        return state
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+def parse_file(writer, state, filename, pool=None):
     if state.filename is None:
         state.filename = filename
     basename = os.path.basename(filename)
+    if pool is not None and basename in _LOG_MEMBERS:
+        pool.submit(writer, state, basename, filename)
+        return state
     with open(filename, "r") as file:
         return _do_parse(writer, state, basename, file)
 
-def parse_paths(writer, state, paths):
+class _TarStreamMember(io.RawIOBase):
+    """Forward-only view of a tarball member opened in stream mode.
+
+    Members of a streamed archive cannot tell whether they are seekable,
+    which io.TextIOWrapper insists on asking.
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        return self.fileobj.readinto(buf)
+
+def parse_tarball(writer, state, path, pool=None):
+    """Parse all members of a (compressed) tarball in a single forward pass.
+
+    The archive is opened in stream mode, so each member is handed to
+    _do_parse while it is being decompressed, without listing the archive
+    first or seeking back to the members afterwards.  With a pool, the
+    independent logs are read into memory and parsed by its workers.
+    """
+    writer.status(f"parsing '{path}'")
+    try:
+        with tarfile.open(path, 'r|*') as tf:
+            for member in tf:
+                data = tf.extractfile(member)
+                if data and pool is not None and member.name in _LOG_MEMBERS:
+                    pool.submit(writer, state, member.name, data.read())
+                elif data:
+                    text = io.TextIOWrapper(io.BufferedReader(_TarStreamMember(data)),
+                                            encoding='utf-8')
+                    state = _do_parse(writer, state, member.name, text)
+    except tarfile.ReadError as error:
+        raise ParseError(f"error: failed reading '{path}': {error}")
+    return state
+
+def parse_paths(writer, state, paths, jobs=1):
+    """Parse all bootchart files, directories and tarballs in paths.  With
+       more than one job, the independent logs are parsed in parallel by a
+       pool of worker processes and merged into state afterwards.
+    """
+    if jobs <= 1:
+        return _parse_paths(writer, state, paths, None)
+    pool = _LogPool(jobs)
+    try:
+        state = _parse_paths(writer, state, paths, pool)
+        return pool.merge(writer, state)
+    finally:
+        pool.shutdown()
+
+def _parse_paths(writer, state, paths, pool):
     for path in paths:
         root, ext = os.path.splitext(path)
         if not os.path.exists(path):
@@ -731,24 +971,14 @@ def parse_paths(writer, state, paths):
         if os.path.isdir(path):
             files = [f for f in [os.path.join(path, f) for f in os.listdir(path)] if os.path.isfile(f)]
             files.sort()
-            state = parse_paths(writer, state, files)
+            state = _parse_paths(writer, state, files, pool)
         elif ext in [".tar", ".tgz", ".gz"]:
             if ext == ".gz":
                 root, ext = os.path.splitext(root)
                 if ext != ".tar":
                     writer.warn(f"warning: zipped '{ext}'-files not supported, only .tar.gz; ignoring")
                     continue
-            tf = None
-            try:
-                writer.status(f"parsing '{path}'")
-                with tarfile.open(path, 'r:*') as tf:
-                    for name in tf.getnames():
-                        data = tf.extractfile(name)
-                        if data:
-                            text = io.TextIOWrapper(data, encoding='utf-8')
-                            state = _do_parse(writer, state, name, text)
-            except tarfile.ReadError as error:
-                raise ParseError(f"error: failed reading '{path}': {error}")
+            state = parse_tarball(writer, state, path, pool)
         else:
-            state = parse_file(writer, state, path)
+            state = parse_file(writer, state, path, pool)
     return state
@@ -13,6 +13,52 @@
 #  You should have received a copy of the GNU General Public License
 #  along with initviz. If not, see <http://www.gnu.org/licenses/>.
 
+from time import perf_counter
+
+from .samples import LifetimeIndex, ProcessIndex
+
+class SubtreeStats:
+    """Aggregates over a process subtree: the earliest start, the latest end
+       (not counting the bootchart collector and its children), the highest
+       pid and the total cpu and I/O load of its samples.
+
+    """
+    __slots__ = ('start_time', 'end_time', 'max_pid', 'cpu', 'io')
+
+    def __init__(self, start_time=100000000, end_time=-100000000, max_pid=-100000000, cpu=0.0, io=0.0):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.max_pid = max_pid
+        self.cpu = cpu
+        self.io = io
+
+    def add(self, other):
+        self.start_time = min(self.start_time, other.start_time)
+        self.end_time = max(self.end_time, other.end_time)
+        self.max_pid = max(self.max_pid, other.max_pid)
+        self.cpu += other.cpu
+        self.io += other.io
+
+class PassStats:
+    """What a reduction pass did to a process tree: its wall time in
+       seconds, the number of processes it removed, the number of processes
+       in the tree before and after it and the number of samples it merged
+       into other processes.
+
+    """
+    __slots__ = ('name', 'elapsed', 'removed', 'nodes_in', 'nodes_out', 'samples_moved')
+
+    def __init__(self, name, elapsed, removed, nodes_in, nodes_out, samples_moved):
+        self.name = name
+        self.elapsed = elapsed
+        self.removed = removed
+        self.nodes_in = nodes_in
+        self.nodes_out = nodes_out
+        self.samples_moved = samples_moved
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
 class ProcessTree:
     """ProcessTree encapsulates a process tree.  The tree is built from log files
        retrieved during the boot process.  When building the process tree, it is
@@ -37,15 +83,27 @@ class ProcessTree:
     LOGGER_PROC = 'bootchartd'
     EXPLODER_PROCESSES = set(['hwup'])
 
+    # The reduction passes, in their default order.  The pruning ones only
+    # run when pruning, remove_kernel_threads only when hiding kernel threads.
+    PASSES = ('merge_logger', 'prune', 'merge_exploders', 'merge_siblings',
+              'merge_runs', 'remove_kernel_threads')
+    PRUNE_PASSES = ('prune', 'merge_exploders', 'merge_siblings', 'merge_runs')
+
     def __init__(self, writer, kernel, psstats, sample_period,
                  monitoredApp, prune, idle, taskstats,
                  accurate_parentage, boot_time=None, for_testing=False, proc_sort='start-time',
-                 exit_proc_pid=None, exit_proc_comm=None, show_kernel=True):
+                 exit_proc_pid=None, exit_proc_comm=None, show_kernel=True,
+                 sibling_merge='adjacent', passes=None):
         self.writer = writer
         self.process_tree = []
+        self.monitored_app = monitoredApp
+        self.pass_stats = []
+        # samples merged into other processes, see merge_processes()
+        self.samples_moved = 0
         self.taskstats = taskstats
         self.proc_sort = proc_sort
         self.show_kernel = show_kernel
+        self.sibling_merge = sibling_merge
         # Convert seconds to centiseconds, like duration is in
         self.boot_time = int(boot_time * 100) if boot_time is not None else None
         self.exit_proc_pid = exit_proc_pid
@@ -56,7 +114,13 @@ class ProcessTree:
             process_list = psstats.process_map.values()
         else:
             process_list = list(kernel) + list(psstats.process_map.values())
-        self.process_list = sorted(process_list, key = lambda p: p.pid)
+        # The tree rearranges copies, so the processes it is built from
+        # stay as compiled and can back further trees
+        copies = dict((p, p.copy()) for p in process_list)
+        for p in copies.values():
+            if p.parent is not None:
+                p.parent = copies.get(p.parent)
+        self.process_list = sorted(copies.values(), key = lambda p: p.pid)
         self.sample_period = sample_period
 
         self.build()
@@ -82,19 +146,11 @@ class ProcessTree:
         if for_testing:
             return
 
-        removed = self.merge_logger(self.process_tree, self.LOGGER_PROC, monitoredApp, False)
-        writer.status("merged %i logger processes" % removed)
-
-        if prune:
-            p_processes = self.prune(self.process_tree, None)
-            p_exploders = self.merge_exploders(self.process_tree, self.EXPLODER_PROCESSES)
-            p_threads = self.merge_siblings(self.process_tree)
-            p_runs = self.merge_runs(self.process_tree)
-            writer.status("pruned %i process, %i exploders, %i threads, and %i runs" % (p_processes, p_exploders, p_threads, p_runs))
-
-        if not self.show_kernel:
-            k_threads = self.remove_kernel_threads(self.process_tree)
-            writer.status("removed %i kernel threads" % k_threads)
+        if passes is None:
+            passes = self.PASSES
+        self.reduce([name for name in passes
+                     if (prune or name not in self.PRUNE_PASSES) and
+                        (not self.show_kernel or name != 'remove_kernel_threads')])
 
         self.sort(self.process_tree)
 
@@ -102,7 +158,41 @@ class ProcessTree:
         self.end_time = self.get_end_time(self.process_tree)
         self.duration = self.end_time - self.start_time
 
-        self.num_proc = self.num_nodes(self.process_tree)
+        self.update_layout()
+
+    def reduce(self, passes):
+        """Runs the named reduction passes over the tree, in the given order,
+           and records what each of them did in pass_stats."""
+        for name in passes:
+            nodes_in = self.num_nodes(self.process_tree)
+            samples_moved = self.samples_moved
+            start = perf_counter()
+            removed = self.run_pass(name)
+            # the passes move, merge and remove processes
+            self.invalidate_stats(self.process_tree)
+            elapsed = perf_counter() - start
+            self.pass_stats.append(PassStats(name, elapsed, removed, nodes_in,
+                                             self.num_nodes(self.process_tree),
+                                             self.samples_moved - samples_moved))
+            self.writer.status("%s: removed %i processes in %.1f ms" % (name, removed, elapsed * 1000))
+
+    def run_pass(self, name):
+        """Runs a single reduction pass, returns the number of processes removed."""
+        if name == 'merge_logger':
+            return self.merge_logger(self.process_tree, self.LOGGER_PROC, self.monitored_app, False)
+        if name == 'prune':
+            return self.prune(self.process_tree, None)
+        if name == 'merge_exploders':
+            return self.merge_exploders(self.process_tree, self.EXPLODER_PROCESSES)
+        if name == 'merge_siblings':
+            if self.sibling_merge == 'concurrent':
+                return self.merge_concurrent_siblings(self.process_tree)
+            return self.merge_siblings(self.process_tree)
+        if name == 'merge_runs':
+            return self.merge_runs(self.process_tree)
+        if name == 'remove_kernel_threads':
+            return self.remove_kernel_threads(self.process_tree)
+        raise ValueError("unknown reduction pass '%s'" % name)
 
     def build(self):
         """Build the process tree from the list of top samples."""
@@ -115,16 +205,6 @@ class ProcessTree:
 
     def sort(self, process_subtree):
         """Sort process tree according to the configured sorting strategy."""
-        def get_cpu_time(proc):
-            """Calculate total CPU time for a process from its samples."""
-            if not proc.samples:
-                return 0
-            total = 0
-            for sample in proc.samples:
-                if sample.cpu_sample:
-                    total += sample.cpu_sample.user + sample.cpu_sample.sys
-            return total
-
         # Choose sorting key based on strategy
         if self.proc_sort == 'pid':
             sort_key = lambda p: p.pid
@@ -133,29 +213,184 @@ class ProcessTree:
             sort_key = lambda p: p.start_time + p.duration
         elif self.proc_sort == 'cpu-time':
             # Sort by CPU time descending (most CPU first)
-            sort_key = lambda p: -get_cpu_time(p)
+            sort_key = lambda p: -p.cpu_total
         else:  # 'start-time' (default)
             sort_key = lambda p: p.start_time
 
-        for p in process_subtree:
+        for p, _ in self.iter_tree(process_subtree):
             p.child_list.sort(key = sort_key)
-            self.sort(p.child_list)
+
+    def iter_tree(self, process_subtree, depth=0):
+        """Yields (process, depth) for every process of the subtree in drawing
+           order, i.e. every process before its children.  Walks the tree with
+           an explicit stack, so the depth of the tree is not limited by the
+           recursion limit.
+
+        """
+        stack = [(p, depth) for p in reversed(process_subtree)]
+        while stack:
+            proc, depth = stack.pop()
+            yield proc, depth
+            stack.extend((c, depth + 1) for c in reversed(proc.child_list))
+
+    def update_layout(self):
+        """Lays the tree out in rows, one per process in drawing order.  For
+           every row this records the process, its depth, the row of its
+           parent and the size of its subtree, which takes up the rows
+           following it.  The row of a process and the row after its subtree
+           are its enter and exit indices in an Euler tour of the tree, see
+           subtree_span().  Needs to be called again once the shape of the
+           tree changes.
+
+        """
+        self.rows = []
+        self.depths = []
+        for proc, depth in self.iter_tree(self.process_tree):
+            self.rows.append(proc)
+            self.depths.append(depth)
+        self.row_of = dict((proc, row) for row, proc in enumerate(self.rows))
+        self.subtree_sizes = [1] * len(self.rows)
+        self.parent_rows = [None] * len(self.rows)
+        for row in range(len(self.rows) - 1, -1, -1):
+            for child in self.rows[row].child_list:
+                child_row = self.row_of[child]
+                self.subtree_sizes[row] += self.subtree_sizes[child_row]
+                self.parent_rows[child_row] = row
+        self.num_proc = len(self.rows)
+        self.lifetime_index = None
+
+    def lifetimes(self):
+        """Returns the LifetimeIndex of the processes in the tree, for
+           looking them up by time.  It is built on first use after each
+           layout."""
+        if self.lifetime_index is None:
+            self.lifetime_index = LifetimeIndex(self.rows)
+        return self.lifetime_index
+
+    def subtree_size(self, proc):
+        """Returns the number of processes in the subtree rooted at proc."""
+        return self.subtree_sizes[self.row_of[proc]]
+
+    def subtree_span(self, proc):
+        """Returns the (enter, exit) indices of proc: its subtree takes up
+           rows[enter:exit]."""
+        enter = self.row_of[proc]
+        return enter, enter + self.subtree_sizes[enter]
+
+    def subtree(self, proc):
+        """Returns the processes in the subtree rooted at proc, in drawing order."""
+        enter, exit = self.subtree_span(proc)
+        return self.rows[enter:exit]
+
+    def first_child_from(self, proc, row):
+        """Returns the first child of proc in row or below, or None."""
+        children = proc.child_list
+        lo, hi = 0, len(children)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.row_of[children[mid]] < row:
+                lo = mid + 1
+            else:
+                hi = mid
+        return children[lo] if lo < len(children) else None
+
+    def is_descendant(self, proc, ancestor):
+        """Whether proc is in the subtree below ancestor."""
+        enter, exit = self.subtree_span(ancestor)
+        return enter < self.row_of[proc] < exit
+
+    def find_rows(self, names):
+        """Returns the rows of the processes called one of names, or with
+           one of them as pid."""
+        pids = set(int(name) for name in names if name.isdigit())
+        names = set(name[:ProcessIndex.NAME_LENGTH] for name in names) | set(names)
+        return [row for row, proc in enumerate(self.rows)
+                if proc.pid // 1000 in pids or proc.cmd in names or proc.exe in names]
+
+    def subtree_roots(self, rows):
+        """Returns those of rows which are not in the subtree of another one."""
+        roots = []
+        end = 0
+        for row in sorted(rows):
+            if row >= end:
+                roots.append(row)
+                end = row + self.subtree_sizes[row]
+        return roots
+
+    def filter_subtrees(self, only=None, exclude=None):
+        """Keeps just the subtrees of the processes named in only, then
+           drops the subtrees of the processes named in exclude.  Processes
+           may be given by name or pid.  Returns the number of processes
+           removed.
+        """
+        num_proc = self.num_proc
+        if only:
+            roots = self.subtree_roots(self.find_rows(only))
+            if roots:
+                self.process_tree = [self.rows[row] for row in roots]
+                self.update_layout()
+            else:
+                self.writer.warn("no process '%s' to show the subtree of" % ",".join(only))
+        if exclude:
+            roots = self.subtree_roots(self.find_rows(exclude))
+            if sum(self.subtree_sizes[row] for row in roots) == self.num_proc:
+                self.writer.warn("not excluding '%s', nothing would be left" % ",".join(exclude))
+            elif roots:
+                removed = set(self.rows[row] for row in roots)
+                self.process_tree = [p for p in self.process_tree if p not in removed]
+                for proc in self.rows:
+                    if any(child in removed for child in proc.child_list):
+                        proc.child_list = [c for c in proc.child_list if c not in removed]
+                self.update_layout()
+        if self.num_proc != num_proc:
+            self.invalidate_stats(self.process_tree)
+            # the cumulative graphs only cover what is left
+            self.process_list = sorted(self.rows, key = lambda p: p.pid)
+        return num_proc - self.num_proc
 
     def num_nodes(self, process_list):
         "Counts the number of nodes in the specified process tree."""
-        nodes = 0
-        for proc in process_list:
-            nodes = nodes + self.num_nodes(proc.child_list)
-        return nodes + len(process_list)
+        return sum(1 for _ in self.iter_tree(process_list))
+
+    def get_stats(self, process_subtree):
+        """Returns the SubtreeStats of the process subtree.  The stats of every
+           process are computed in a single post-order pass and kept on the
+           process until invalidate_stats() is called.
+        """
+        stack = [(p, False) for p in process_subtree if p.subtree_stats is None]
+        while stack:
+            proc, children_done = stack.pop()
+            if proc.subtree_stats is not None:
+                continue
+            if not children_done:
+                stack.append((proc, True))
+                stack.extend((c, False) for c in proc.child_list if c.subtree_stats is None)
+                continue
+            stats = SubtreeStats(proc.start_time, proc.start_time + proc.duration, proc.pid,
+                                 proc.cpu_total, proc.io_total)
+            for child in proc.child_list:
+                stats.add(child.subtree_stats)
+            # Exclude bootchartd and bootchart-collector from boot time calculation
+            if proc.cmd in ('bootchartd', 'bootchart-colle'):
+                stats.end_time = -100000000
+            proc.subtree_stats = stats
+
+        stats = SubtreeStats()
+        for proc in process_subtree:
+            stats.add(proc.subtree_stats)
+        return stats
+
+    def invalidate_stats(self, process_subtree):
+        """Forgets the stats of the subtree, after its shape or processes changed."""
+        for proc, _ in self.iter_tree(process_subtree):
+            proc.subtree_stats = None
 
     def get_start_time(self, process_subtree):
         """Returns the start time of the process subtree.  This is the start
            time of the earliest process.
 
         """
-        if not process_subtree:
-            return 100000000
-        return min( [min(proc.start_time, self.get_start_time(proc.child_list)) for proc in process_subtree] )
+        return self.get_stats(process_subtree).start_time
 
     def get_end_time(self, process_subtree):
         """Returns the end time of the process subtree.  This is the end time
@@ -163,18 +398,11 @@ class ProcessTree:
            to avoid including post-boot data collection time in the boot duration.
 
         """
-        if not process_subtree:
-            return -100000000
-        # Exclude bootchartd and bootchart-collector from boot time calculation
-        return max( [max(proc.start_time + proc.duration, self.get_end_time(proc.child_list))
-                     for proc in process_subtree
-                     if proc.cmd not in ('bootchartd', 'bootchart-colle')] + [-100000000] )
+        return self.get_stats(process_subtree).end_time
 
     def get_max_pid(self, process_subtree):
         """Returns the max PID found in the process tree."""
-        if not process_subtree:
-            return -100000000
-        return max( [max(proc.pid, self.get_max_pid(proc.child_list)) for proc in process_subtree] )
+        return self.get_stats(process_subtree).max_pid
 
     def update_ppids_for_daemons(self, process_list):
         """Fedora hack: when loading the system services from rc, runuser(1)
@@ -198,6 +426,7 @@ class ProcessTree:
                     p.parent = rcproc
             for p in process_list:
                 p.child_list = []
+                p.subtree_stats = None
             self.build()
 
     def prune(self, process_subtree, parent):
@@ -213,36 +442,43 @@ class ProcessTree:
                    process_end >= self.start_time + self.duration and \
                    p.start_time > self.start_time and \
                    p.duration > 0.9 * self.duration and \
-                   self.num_nodes(p.child_list) == 0
+                   len(p.child_list) == 0
+
+        def is_pruned(p, parent):
+            if parent == None and len(p.child_list) != 0:
+                return False
+            # Never prune the EXIT_PROC process
+            if self.exit_proc_pid is not None and p.pid == self.exit_proc_pid:
+                return False
+            if is_idle_background_process_without_children(p):
+                return True
+            # short-lived process
+            return p.duration <= 2 * self.sample_period
+
+        return self._remove_processes(process_subtree, parent, is_pruned)
+
+    def _remove_processes(self, process_subtree, parent, is_removed):
+        """Removes the processes for which is_removed(process, parent) is
+           true from the subtree, moving their children up in their place.
+           Children which move up are checked in turn, last one first.  Each
+           child list is rebuilt in a single pass.
 
+        """
         num_removed = 0
-        idx = 0
-        while idx < len(process_subtree):
-            p = process_subtree[idx]
-            if parent != None or len(p.child_list) == 0:
-
-                prune = False
-                # Never prune the EXIT_PROC process
-                if self.exit_proc_pid is not None and p.pid == self.exit_proc_pid:
-                    prune = False
-                elif is_idle_background_process_without_children(p):
-                    prune = True
-                elif p.duration <= 2 * self.sample_period:
-                    # short-lived process
-                    prune = True
-
-                if prune:
-                    process_subtree.pop(idx)
-                    for c in p.child_list:
-                        process_subtree.insert(idx, c)
+        levels = [(process_subtree, parent)]
+        while levels:
+            subtree, parent = levels.pop()
+            kept = []
+            pending = subtree[::-1]
+            while pending:
+                p = pending.pop()
+                if is_removed(p, parent):
+                    pending.extend(p.child_list)
                     num_removed += 1
                     continue
-                else:
-                    num_removed += self.prune(p.child_list, p)
-            else:
-                num_removed += self.prune(p.child_list, p)
-            idx += 1
-
+                kept.append(p)
+                levels.append((p.child_list, p))
+            subtree[:] = kept
         return num_removed
 
     def remove_kernel_threads(self, process_subtree):
@@ -260,38 +496,15 @@ class ProcessTree:
                 return True
             return False
 
-        num_removed = 0
-        idx = 0
-        while idx < len(process_subtree):
-            p = process_subtree[idx]
-
-            if is_kernel_thread(p):
-                # Remove this kernel thread and promote its children
-                process_subtree.pop(idx)
-                for c in p.child_list:
-                    process_subtree.insert(idx, c)
-                num_removed += 1
-                continue
-            else:
-                # Recursively check children
-                num_removed += self.remove_kernel_threads(p.child_list)
-
-            idx += 1
-
-        return num_removed
+        # Remove kernel threads and promote their children
+        return self._remove_processes(process_subtree, None, lambda p, parent: is_kernel_thread(p))
 
     def filter_subtree(self, tree, filter_fn):
         """
         Filter a tree depending on filter function that takes the process as
         argument.
         """
-        processes = []
-        for p in tree:
-            if filter_fn(p):
-                processes.append(p)
-            if p.child_list:
-                processes += self.filter_subtree(p.child_list, filter_fn)
-        return processes
+        return [p for p, _ in self.iter_tree(tree) if filter_fn(p)]
 
     def merge_logger(self, process_subtree, logger_proc, monitored_app, app_tree):
         """Merges the logger's process subtree.  The logger will typically
@@ -333,21 +546,67 @@ class ProcessTree:
 
         """
         num_removed = 0
-        idx = 0
-        while idx < len(process_subtree)-1:
-            p = process_subtree[idx]
-            nextp = process_subtree[idx+1]
-            if nextp.cmd == p.cmd:
-                process_subtree.pop(idx+1)
-                idx -= 1
-                num_removed += 1
-                p.child_list.extend(nextp.child_list)
-                self.merge_processes(p, nextp)
-            num_removed += self.merge_siblings(p.child_list)
-            idx += 1
-        if len(process_subtree) > 0:
-            p = process_subtree[-1]
-            num_removed += self.merge_siblings(p.child_list)
+        levels = [process_subtree]
+        while levels:
+            subtree = levels.pop()
+            kept = []
+            threads = []
+            for p in subtree:
+                if kept and kept[-1].cmd == p.cmd:
+                    threads[-1].append(p)
+                else:
+                    kept.append(p)
+                    threads.append([])
+            subtree[:] = kept
+            for p, p_threads in zip(kept, threads):
+                if p_threads:
+                    # fold the whole run of threads into the first in one go
+                    num_removed += len(p_threads)
+                    for thread in p_threads:
+                        p.child_list.extend(thread.child_list)
+                    self.merge_processes(p, *p_threads)
+                levels.append(p.child_list)
+        return num_removed
+
+    def merge_concurrent_siblings(self, process_subtree):
+        """Merges thread processes regardless of their order.  Siblings are
+           grouped by command line, and within a group the processes whose
+           lifetimes overlap are merged together into the one started first.
+
+        """
+        num_removed = 0
+        levels = [process_subtree]
+        while levels:
+            subtree = levels.pop()
+            groups = {}
+            for pos, p in enumerate(subtree):
+                groups.setdefault(p.cmd, []).append((p.start_time, pos, p))
+            merged = set()
+            for group in groups.values():
+                if len(group) < 2:
+                    continue
+                group.sort(key = lambda g: g[:2])
+                # sweep through the group in start order, a process which
+                # starts before all earlier ones ended joins their cluster
+                clusters = []
+                for start, _, p in group:
+                    if clusters and start < end:
+                        clusters[-1].append(p)
+                        end = max(end, start + p.duration)
+                    else:
+                        clusters.append([p])
+                        end = start + p.duration
+                for p, *threads in clusters:
+                    if not threads:
+                        continue
+                    for thread in threads:
+                        p.child_list.extend(thread.child_list)
+                    self.merge_processes(p, *threads)
+                    merged.update(threads)
+                    num_removed += len(threads)
+            if merged:
+                subtree[:] = [p for p in subtree if p not in merged]
+            levels.extend(p.child_list for p in subtree)
         return num_removed
 
     def merge_runs(self, process_subtree):
@@ -356,28 +615,34 @@ class ProcessTree:
 
         """
         num_removed = 0
-        idx = 0
-        while idx < len(process_subtree):
-            p = process_subtree[idx]
-            if len(p.child_list) == 1 and p.child_list[0].cmd == p.cmd:
+        # the walk goes on to the children once the run is merged
+        for p, _ in self.iter_tree(process_subtree):
+            while len(p.child_list) == 1 and p.child_list[0].cmd == p.cmd:
                 child = p.child_list[0]
                 p.child_list = list(child.child_list)
                 self.merge_processes(p, child)
                 num_removed += 1
-                continue
-            num_removed += self.merge_runs(p.child_list)
-            idx += 1
         return num_removed
 
-    def merge_processes(self, p1, p2):
-        """Merges two process' samples."""
-        p1.samples.extend(p2.samples)
-        p1.samples.sort( key = lambda p: p.time )
-        p1time = p1.start_time
-        p2time = p2.start_time
-        p1.start_time = min(p1time, p2time)
-        pendtime = max(p1time + p1.duration, p2time + p2.duration)
-        p1.duration = pendtime - p1.start_time
+    def merge_processes(self, p1, *others):
+        """Merges the samples and lifetimes of the other processes into p1."""
+        if p1.samples_shared:
+            p1.samples = p1.samples.copy()
+            p1.samples_shared = False
+        p1.samples.merge(*[p2.samples for p2 in others])
+        self.samples_moved += sum(len(p2.samples) for p2 in others)
+        # merging keeps every sample, so the totals add up
+        for p2 in others:
+            p1.cpu_total += p2.cpu_total
+            p1.io_total += p2.io_total
+            p1.swap_total += p2.swap_total
+            p1.sample_count += p2.sample_count
+            p1.active_count += p2.active_count
+            p1time = p1.start_time
+            p2time = p2.start_time
+            p1.start_time = min(p1time, p2time)
+            pendtime = max(p1time + p1.duration, p2time + p2.duration)
+            p1.duration = pendtime - p1.start_time
 
     def _dump_tree(self, process_subtree, shift=0):
         """Get a tree printed throught the writer, helpful when debugging."""
@@ -13,8 +13,16 @@
 #  You should have received a copy of the GNU General Public License
 #  along with initviz. If not, see <http://www.gnu.org/licenses/>.
 
+import heapq
+import itertools
+import operator
+from array import array
+from bisect import bisect_left, bisect_right
+
 
 class DiskStatSample:
+    __slots__ = ('time', 'diskdata')
+
     def __init__(self, time):
         self.time = time
         self.diskdata = [0, 0, 0]
@@ -22,6 +30,8 @@ class DiskStatSample:
         self.diskdata = [ a + b for a, b in zip(self.diskdata, new_diskdata) ]
 
 class CPUSample:
+    __slots__ = ('time', 'user', 'sys', 'io', 'swap')
+
     def __init__(self, time, user, sys, io = 0.0, swap = 0.0):
         self.time = time
         self.user = user
@@ -39,20 +49,32 @@ class CPUSample:
 
 class MemSample:
     used_values = ('MemTotal', 'MemFree', 'Buffers', 'Cached', 'SwapTotal', 'SwapFree',)
+    fields = ('mem_total', 'mem_free', 'buffers', 'cached', 'swap_total', 'swap_free',)
+    __slots__ = ('time',) + fields
 
     def __init__(self, time):
         self.time = time
-        self.records = {}
+        for field in MemSample.fields:
+            setattr(self, field, None)
 
     def add_value(self, name, value):
-        self.records[name] = value
+        if name in MemSample.used_values:
+            setattr(self, MemSample.fields[MemSample.used_values.index(name)], value)
+
+    @property
+    def records(self):
+        """The values keyed by their /proc/meminfo name."""
+        return dict((name, getattr(self, field))
+                    for name, field in zip(MemSample.used_values, MemSample.fields)
+                    if getattr(self, field) is not None)
 
     def valid(self):
-        keys = self.records.keys()
         # discard incomplete samples
-        return [v for v in MemSample.used_values if v not in keys] == []
+        return [f for f in MemSample.fields if getattr(self, f) is None] == []
 
 class ProcessSample:
+    __slots__ = ('time', 'state', 'cpu_sample')
+
     def __init__(self, time, state, cpu_sample):
         self.time = time
         self.state = state
@@ -61,6 +83,132 @@ class ProcessSample:
     def __str__(self):
         return str(self.time) + "\t" + str(self.state) + "\t" + str(self.cpu_sample)
 
+class ProcessSamples:
+    """Columnar store of the samples of a single process.
+
+    Every sample is an entry in a set of typed arrays (time, state, user,
+    sys, io and swap) rather than a ProcessSample and CPUSample object pair.
+    The samples are kept in chronological order, so time ranges can be
+    looked up with bisect.  Indexing and iteration hand out ProcessSample
+    views for code that wants the object representation.
+    """
+    __slots__ = ('time', 'state', 'user', 'sys', 'io', 'swap')
+
+    def __init__(self):
+        self.time = array('q')
+        self.state = array('B')  # ps(1) state letter, as character code
+        self.user = array('d')
+        self.sys = array('d')
+        self.io = array('d')
+        self.swap = array('d')
+
+    def columns(self):
+        return (self.time, self.state, self.user, self.sys, self.io, self.swap)
+
+    def add(self, time, state, user, sys, io = 0.0, swap = 0.0):
+        self.time.append(time)
+        self.state.append(ord(state))
+        self.user.append(user)
+        self.sys.append(sys)
+        self.io.append(io)
+        self.swap.append(swap)
+
+    def append(self, sample):
+        cpu = sample.cpu_sample
+        self.add(sample.time, sample.state, cpu.user, cpu.sys, cpu.io, cpu.swap)
+
+    def copy(self):
+        copy = ProcessSamples()
+        copy.extend(self)
+        return copy
+
+    def extend(self, other):
+        for column, other_column in zip(self.columns(), other.columns()):
+            column.extend(other_column)
+
+    def merge(self, *others):
+        """Merge in the samples of others.  All of them are in chronological
+           order already, so this is a single k-way merge pass.  Samples taken
+           at the same time keep their order, ours first."""
+        sources = [self] + [other for other in others if len(other)]
+        if len(sources) == 1:
+            return
+        if len(sources) == 2:
+            self._merge_two(sources[1])
+            return
+        if all(len(a) == 0 or a.time[-1] <= b.time[0] for a, b in zip(sources, sources[1:])):
+            # no overlap, e.g. consecutive runs of a process
+            for other in sources[1:]:
+                self.extend(other)
+            return
+        order = list(heapq.merge(*[zip(source.time, itertools.repeat(n), range(len(source)))
+                                   for n, source in enumerate(sources)]))
+        columns = [source.columns() for source in sources]
+        for c, column in enumerate(self.columns()):
+            column[:] = array(column.typecode, [columns[n][c][i] for _, n, i in order])
+
+    def _merge_two(self, other):
+        times = self.time
+        if not times or times[-1] <= other.time[0]:
+            self.extend(other)
+            return
+        # (position in ours, first, last + 1) of the runs of other's samples
+        # which go in between two of ours
+        runs = []
+        j = 0
+        while j < len(other):
+            pos = bisect_right(times, other.time[j])
+            end = bisect_left(other.time, times[pos], j) if pos < len(times) else len(other)
+            runs.append((pos, j, end))
+            j = end
+        for column, other_column in zip(self.columns(), other.columns()):
+            merged = array(column.typecode)
+            prev = 0
+            for pos, j, end in runs:
+                merged.extend(column[prev:pos])
+                merged.extend(other_column[j:end])
+                prev = pos
+            merged.extend(column[prev:])
+            column[:] = merged
+
+    def sort(self):
+        """Sort chronologically, samples at the same time keep their order."""
+        order = sorted(range(len(self.time)), key = self.time.__getitem__)
+        for column in self.columns():
+            column[:] = array(column.typecode, [column[i] for i in order])
+
+    def crop(self, end_time):
+        """Drop all samples taken after end_time."""
+        end = bisect_right(self.time, end_time)
+        for column in self.columns():
+            del column[end:]
+
+    def span(self, start_time, end_time):
+        """Returns the (first, last + 1) indices of the samples taken
+           within [start_time, end_time]."""
+        return bisect_left(self.time, start_time), bisect_right(self.time, end_time)
+
+    @property
+    def cpu(self):
+        return array('d', map(operator.add, self.user, self.sys))
+
+    def pop(self):
+        sample = self[-1]
+        for column in self.columns():
+            column.pop()
+        return sample
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, i):
+        cpu_sample = CPUSample('null', self.user[i], self.sys[i], self.io[i], self.swap[i])
+        return ProcessSample(self.time[i], chr(self.state[i]), cpu_sample)
+
+    def __iter__(self):
+        for i in range(len(self.time)):
+            yield self[i]
+
 class ProcessStats:
     def __init__(self, writer, process_map, sample_count, sample_period, start_time, end_time):
         self.process_map = process_map
@@ -71,7 +219,146 @@ class ProcessStats:
         writer.info ("%d samples, avg. sample length %f" % (self.sample_count, self.sample_period))
         writer.info ("process list size: %d" % len (self.process_map.values()))
 
+class ProcessIndex:
+    """Processes by command and executable name, earliest started first.
+
+    Command names are truncated by the kernel, so names looked up are
+    truncated the same way.
+    """
+    NAME_LENGTH = 15
+
+    __slots__ = ('by_name', 'search_keys')
+
+    def __init__(self, processes):
+        self.by_name = {}
+        for proc in processes:
+            self.by_name.setdefault(proc.cmd, []).append(proc)
+            if proc.exe and proc.exe != proc.cmd:
+                self.by_name.setdefault(proc.exe, []).append(proc)
+        key = operator.attrgetter('start_time', 'pid')
+        for procs in self.by_name.values():
+            procs.sort(key=key)
+        # lower cased cmd, exe and args to processes, built on first search
+        self.search_keys = None
+
+    def lookup(self, name):
+        """Returns the processes called name, ordered by start time."""
+        return self.by_name.get(name[:self.NAME_LENGTH], [])
+
+    def first(self, names):
+        """Returns the earliest started process called any of names, or None."""
+        first = None
+        for name in names:
+            procs = self.lookup(name)
+            if procs and (first is None or procs[0].start_time < first.start_time):
+                first = procs[0]
+        return first
+
+    def search(self, text):
+        """Returns the set of processes whose cmd, exe or one of the args
+           contains text, ignoring case."""
+        if self.search_keys is None:
+            self.search_keys = {}
+            for procs in self.by_name.values():
+                for proc in procs:
+                    for key in [proc.cmd, proc.exe] + (proc.args or []):
+                        if key:
+                            self.search_keys.setdefault(key.lower(), set()).add(proc)
+        text = text.lower()
+        matches = set()
+        for key, procs in self.search_keys.items():
+            if text in key:
+                matches |= procs
+        return matches
+
+class LifetimeIndex:
+    """Processes by the time they were alive, from their start_time up to
+    and including start_time + duration.
+
+    The processes are sorted by start time and laid over an implicit
+    balanced binary tree, the middle process of every range being the
+    root of that range.  Each root knows the latest end in its range, so
+    a query only descends into ranges which can hold a match and takes
+    logarithmic time plus the time to report the matches.
+    """
+    __slots__ = ('processes', 'starts', 'ends', 'max_ends', 'cpu_sums')
+
+    def __init__(self, processes):
+        self.processes = sorted(processes, key=operator.attrgetter('start_time', 'pid'))
+        self.starts = [proc.start_time for proc in self.processes]
+        self.ends = [proc.start_time + proc.duration for proc in self.processes]
+        self.max_ends = list(self.ends)
+        self._build_max_ends(0, len(self.processes))
+        # prefix sums of the cpu load of each process's samples
+        self.cpu_sums = dict((proc, array('d', itertools.accumulate(proc.samples.cpu, initial=0.0)))
+                             for proc in self.processes)
+
+    def _build_max_ends(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        for end in (self._build_max_ends(lo, mid), self._build_max_ends(mid + 1, hi)):
+            if end is not None and end > self.max_ends[mid]:
+                self.max_ends[mid] = end
+        return self.max_ends[mid]
+
+    def overlapping(self, start_time, end_time):
+        """Returns the processes alive at some point of [start_time, end_time],
+           ordered by start time."""
+        found = []
+        ranges = [(0, len(self.processes))]
+        while ranges:
+            lo, hi = ranges.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self.max_ends[mid] < start_time:
+                continue
+            ranges.append((lo, mid))
+            if self.starts[mid] <= end_time:
+                if self.ends[mid] >= start_time:
+                    found.append(mid)
+                ranges.append((mid + 1, hi))
+        found.sort()
+        return [self.processes[i] for i in found]
+
+    def at(self, time):
+        """Returns the processes alive at time, ordered by start time."""
+        return self.overlapping(time, time)
+
+    def running_at(self, time):
+        """Returns the processes using the cpu in the sample period taking
+           in time, ordered by start time."""
+        running = []
+        for proc in self.at(time):
+            samples = proc.samples
+            i = bisect_left(samples.time, time)
+            if i < len(samples) and samples.user[i] + samples.sys[i] > 0:
+                running.append(proc)
+        return running
+
+    def cpu(self, proc, start_time, end_time):
+        """Returns the cpu load of the samples of proc taken within
+           [start_time, end_time]."""
+        sums = self.cpu_sums[proc]
+        first, last = proc.samples.span(start_time, end_time)
+        return sums[last] - sums[first]
+
+    def top_cpu(self, start_time, end_time, count):
+        """Returns the count processes with the highest cpu load within
+           [start_time, end_time], highest first."""
+        return heapq.nlargest(count, self.overlapping(start_time, end_time),
+                              key=lambda proc: self.cpu(proc, start_time, end_time))
+
 class Process:
+    # counters which are only needed while parsing the logs
+    PARSE_STATE = ('last_user_cpu_time', 'last_sys_cpu_time',
+                   'last_cpu_ns', 'last_blkio_delay_ns', 'last_swapin_delay_ns')
+    __slots__ = ('writer', 'pid', 'cmd', 'exe', 'args', 'ppid', 'start_time',
+                 'duration', 'samples', 'parent', 'child_list', 'active',
+                 'cpu_total', 'io_total', 'swap_total', 'sample_count', 'active_count',
+                 'subtree_stats', 'samples_shared') + PARSE_STATE
+
     def __init__(self, writer, pid, cmd, ppid, start_time):
         self.writer = writer
         self.pid = pid
@@ -81,9 +368,19 @@ class Process:
         self.ppid = ppid
         self.start_time = start_time
         self.duration = 0
-        self.samples = []
+        self.samples = ProcessSamples()
+        # set on copies, which share the samples until they are merged
+        self.samples_shared = False
         self.parent = None
         self.child_list = []
+        # totals over the samples, see calc_totals()
+        self.cpu_total = 0.0
+        self.io_total = 0.0
+        self.swap_total = 0.0
+        self.sample_count = 0
+        self.active_count = 0
+        # aggregates over this process and its descendants, see ProcessTree
+        self.subtree_stats = None
 
         self.active = None
         self.last_user_cpu_time = None
@@ -103,19 +400,45 @@ class Process:
 
         return split
 
+    def copy(self):
+        """Returns a copy for a ProcessTree to rearrange, without children
+           of its own yet.  It shares the samples with this process."""
+        copy = Process.__new__(Process)
+        for name in Process.__slots__:
+            if hasattr(self, name):
+                setattr(copy, name, getattr(self, name))
+        copy.child_list = []
+        copy.subtree_stats = None
+        copy.samples_shared = True
+        return copy
+
+    def discard_parse_state(self):
+        """Drop the parse-only counters, once the trace is compiled."""
+        for name in Process.PARSE_STATE:
+            if hasattr(self, name):
+                delattr(self, name)
+
     def __str__(self):
         return " ".join([str(self.pid), self.cmd, str(self.ppid), '[ ' + str(len(self.samples)) + ' samples ]' ])
 
     def calc_stats(self, samplePeriod):
-        if self.samples:
-            firstSample = self.samples[0]
-            lastSample = self.samples[-1]
-            self.start_time = min(firstSample.time, self.start_time)
-            self.duration = lastSample.time - self.start_time + samplePeriod
+        samples = self.samples
+        if samples:
+            self.start_time = min(samples.time[0], self.start_time)
+            self.duration = samples.time[-1] - self.start_time + samplePeriod
 
-        activeCount = sum( [1 for sample in self.samples if sample.cpu_sample and sample.cpu_sample.sys + sample.cpu_sample.user + sample.cpu_sample.io > 0.0] )
-        activeCount = activeCount + sum( [1 for sample in self.samples if sample.state == 'D'] )
-        self.active = (activeCount>2)
+        self.calc_totals()
+        self.active = (self.active_count>2)
+
+    def calc_totals(self):
+        """Sums up the samples, once they have changed."""
+        samples = self.samples
+        self.cpu_total = sum(samples.cpu)
+        self.io_total = sum(samples.io)
+        self.swap_total = sum(samples.swap)
+        self.sample_count = len(samples)
+        activeCount = sum(1 for user, sys, io in zip(samples.user, samples.sys, samples.io) if sys + user + io > 0.0)
+        self.active_count = activeCount + samples.state.count(ord('D'))
 
     def calc_load(self, userCpu, sysCpu, interval):
         userCpuLoad = float(userCpu - self.last_user_cpu_time) / interval
@@ -139,6 +462,8 @@ class Process:
         return self.start_time + self.duration
 
 class DiskSample:
+    __slots__ = ('time', 'read', 'write', 'util', 'tput')
+
     def __init__(self, time, read, write, util):
         self.time = time
         self.read = read
@@ -0,0 +1,73 @@
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.getcwd())
+
+import initviz.cache as cache
+import initviz.main as main
+
+class TestTraceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.rootdir = os.path.join(os.path.dirname(sys.argv[0]), '../../examples/1/')
+        self.cachedir = tempfile.mkdtemp()
+        self.parser = main._mk_options_parser()
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def load(self, trace_cache, argv):
+        options, args = self.parser.parse_args(['--q'] + argv + [self.rootdir])
+        writer = main._mk_writer(options)
+        key = trace_cache.key(args, options)
+        trace = trace_cache.load(writer, key)
+        if trace is None:
+            trace = main.parsing.Trace(writer, args, options)
+            trace_cache.store(writer, key, trace)
+        return writer, key, trace
+
+    def testRoundTrip(self):
+        trace_cache = cache.TraceCache(self.cachedir)
+        _, key, trace = self.load(trace_cache, [])
+        self.assertTrue(os.path.exists(trace_cache.entry(key)))
+
+        writer, key2, cached = self.load(trace_cache, [])
+        self.assertEqual(key, key2)
+        self.assertEqual(trace.proc_tree.num_proc, cached.proc_tree.num_proc)
+        self.assertEqual(len(trace.cpu_stats), len(cached.cpu_stats))
+        self.assertTrue(cached.proc_tree.writer is writer)
+        for proc in cached.proc_tree.process_list:
+            self.assertTrue(proc.writer is writer)
+
+    def testKeyOptions(self):
+        trace_cache = cache.TraceCache(self.cachedir)
+        _, key, _ = self.load(trace_cache, [])
+        _, key2, _ = self.load(trace_cache, ['--no-prune'])
+        _, key3, _ = self.load(trace_cache, ['--no-prune', '--xscale', '2'])
+        self.assertNotEqual(key, key2)
+        self.assertEqual(key2, key3)
+
+    def testEviction(self):
+        trace_cache = cache.TraceCache(self.cachedir)
+        _, key, _ = self.load(trace_cache, [])
+        _, key2, _ = self.load(trace_cache, ['--no-prune'])
+        os.utime(trace_cache.entry(key), (0, 0))
+
+        trace_cache.max_size = os.path.getsize(trace_cache.entry(key2))
+        trace_cache.evict()
+        self.assertFalse(os.path.exists(trace_cache.entry(key)))
+        self.assertTrue(os.path.exists(trace_cache.entry(key2)))
+
+    def testCorruptEntry(self):
+        trace_cache = cache.TraceCache(self.cachedir)
+        _, key, _ = self.load(trace_cache, [])
+        with open(trace_cache.entry(key), 'wb') as f:
+            f.write(b'garbage')
+        writer = main._mk_writer(self.parser.parse_args(['--q'])[0])
+        self.assertEqual(None, trace_cache.load(writer, key))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import sys
+import os
+import math
+import random
+import unittest
+
+sys.path.insert(0, os.getcwd())
+
+import cairo
+import initviz.draw as draw
+import initviz.main as main
+import initviz.parsing as parsing
+
+class TestChartReduction(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(42)
+        self.points = [(t, rand.random()) for t in range(0, 100000, 3)]
+
+    def columns(self, points, px_scale):
+        columns = {}
+        for point in points:
+            columns.setdefault(math.floor(point[0] * px_scale), []).append(point)
+        return columns
+
+    def testReduceToColumns(self):
+        px_scale = 0.01
+        reduced = draw.reduce_to_columns(self.points, 0, px_scale)
+        self.assertEqual(self.points[0], reduced[0])
+        self.assertEqual(self.points[-1], reduced[-1])
+        self.assertEqual(sorted(reduced), reduced)
+
+        expected = self.columns(self.points, px_scale)
+        actual = self.columns(reduced, px_scale)
+        self.assertEqual(sorted(expected), sorted(actual))
+        for column, points in expected.items():
+            kept = actual[column]
+            self.assertTrue(len(kept) <= 4)
+            self.assertEqual((points[0], points[-1]), (kept[0], kept[-1]))
+            self.assertEqual(min(y for _, y in points), min(y for _, y in kept))
+            self.assertEqual(max(y for _, y in points), max(y for _, y in kept))
+
+    def testFewPointsKept(self):
+        self.assertTrue(draw.reduce_to_columns(self.points, 0, 1.0) is self.points)
+
+    def testSeriesCachedPerScale(self):
+        series = draw.ChartSeries(self.points)
+        reduced = series.reduce(0, 0.01)
+        self.assertTrue(series.reduce(0, 0.01) is reduced)
+        self.assertTrue(len(series.reduce(0, 0.1)) > len(reduced))
+        self.assertEqual(max(y for _, y in self.points), series.max_y)
+
+    def testLeastRecentlyUsedEvicted(self):
+        series = draw.ChartSeries(self.points)
+        first = series.reduce(0, 0.01)
+        for n in range(1, series.MAX_REDUCED + 4):
+            series.reduce(0, 0.01 + n * 0.001)
+            # drawn at every other scale, so kept
+            self.assertTrue(series.reduce(0, 0.01) is first)
+        self.assertEqual(series.MAX_REDUCED, len(series.reduced))
+        self.assertFalse((0, 0.011) in series.reduced)
+
+class TestVisibleRows(unittest.TestCase):
+
+    class Tree:
+        num_proc = 1000
+
+    def testVisibleRows(self):
+        tree = self.Tree()
+        self.assertEqual((0, 11), draw.visible_rows(tree, 100, 16, (0, 0, 800, 250)))
+        self.assertEqual((599, 627), draw.visible_rows(tree, 100, 16, (0, 100 + 600 * 16, 800, 400)))
+        self.assertEqual((995, 1000), draw.visible_rows(tree, 100, 16, (0, 100 + 996 * 16, 800, 400)))
+        self.assertEqual((1000, 1000), draw.visible_rows(tree, 100, 16, (0, 100 + 3000 * 16, 800, 400)))
+        self.assertEqual((0, 0), draw.visible_rows(tree, 1000, 16, (0, 0, 800, 400)))
+
+class TestChartLayout(unittest.TestCase):
+
+    def setUp(self):
+        rootdir = os.path.join(os.path.dirname(sys.argv[0]), '../../examples/1/')
+        parser = main._mk_options_parser()
+        app_options, args = parser.parse_args(['--q', rootdir])
+        self.trace = parsing.Trace(main._mk_writer(app_options), args, app_options)
+        self.options = draw.RenderOptions(app_options)
+        self.ctx = cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1))
+
+    def testCached(self):
+        layout = draw.chart_layout(self.ctx, self.options, 1.0, self.trace)
+        self.assertTrue(draw.chart_layout(self.ctx, self.options, 1.0, self.trace) is layout)
+        self.assertFalse(draw.chart_layout(self.ctx, self.options, 2.0, self.trace) is layout)
+
+    def testRows(self):
+        layout = draw.chart_layout(self.ctx, self.options, 1.0, self.trace)
+        proc_tree = layout.proc_tree
+        self.assertTrue(proc_tree is self.trace.proc_tree)
+        self.assertTrue(layout.rows_y > layout.bands['disk'][1])
+        for row in range(proc_tree.num_proc):
+            self.assertEqual(row, layout.row_at(layout.row_y(row)))
+            self.assertEqual(row, layout.row_at(layout.row_y(row) + layout.proc_h - 1))
+            x, y, w, h = layout.proc_rect(row)
+            self.assertTrue(layout.proc_at(x + w / 2, y + h / 2) is proc_tree.rows[row])
+            self.assertAlmostEqual(proc_tree.rows[row].start_time, layout.time_at(x))
+            self.assertEqual(None, layout.proc_at(x - 1, y + h / 2))
+        self.assertEqual(None, layout.row_at(layout.row_y(-1)))
+        self.assertEqual(None, layout.row_at(layout.row_y(proc_tree.num_proc)))
+
+    def testNoCharts(self):
+        with_charts = draw.chart_layout(self.ctx, self.options, 1.0, self.trace)
+        self.options.charts = False
+        layout = draw.chart_layout(self.ctx, self.options, 1.0, self.trace)
+        self.assertFalse('cpu' in layout.bands)
+        self.assertTrue(layout.rows_y < with_charts.rows_y)
+
+    def testRenderedLayout(self):
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 400, 300)
+        ctx = cairo.Context(surface)
+        ctx.rectangle(0, 500, 400, 300)
+        ctx.clip()
+        self.assertTrue(draw.render(ctx, self.options, 1.0, self.trace) is
+                        draw.chart_layout(self.ctx, self.options, 1.0, self.trace))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,4 @@
-import sys, os, re, struct, operator, math
+import sys, os, io, re, struct, operator, math, shutil, tempfile
 from collections import defaultdict
 import unittest
 
@@ -37,6 +37,66 @@ class TestBCParser(unittest.TestCase):
 		state = parsing.parse_file(writer, trace, self.mk_fname('proc_diskstats.log'))
 		self.assertEqual(141, len(state.disk_stats))		
 
+	def testParseTarball(self):
+		tarball = os.path.join(self.rootdir, '../5/busybox_bootlog.tgz')
+		trace = parsing.Trace(writer, [tarball], options)
+		self.assertTrue(trace.valid())
+		self.assertTrue(len(trace.cpu_stats) > 0)
+		self.assertTrue(len(trace.ps_stats.process_map) > 0)
+
+	def testParseParallel(self):
+		trace = parsing.Trace(writer, args, options)
+		parallel_options, parallel_args = parser.parse_args(['--q', '--jobs', '2', bootchart_dir])
+		parallel = parsing.Trace(writer, parallel_args, parallel_options)
+		self.assertEqual([str(s) for s in trace.cpu_stats], [str(s) for s in parallel.cpu_stats])
+		self.assertEqual([str(s) for s in trace.disk_stats], [str(s) for s in parallel.disk_stats])
+		self.assertEqual(sorted(trace.ps_stats.process_map.keys()), sorted(parallel.ps_stats.process_map.keys()))
+		for proc in parallel.ps_stats.process_map.values():
+			self.assertIs(writer, proc.writer)
+
+	def testProcessSamples(self):
+		samples = parsing.ProcessSamples()
+		samples.add(20, 'R', 0.5, 0.25)
+		samples.add(10, 'S', 0.0, 0.0)
+		samples.add(20, 'D', 0.0, 0.0, 3.0)
+		samples.sort()
+		self.assertEqual([10, 20, 20], list(samples.time))
+		self.assertEqual(['S', 'R', 'D'], [sample.state for sample in samples])
+		self.assertTrue(floatEq(0.75, samples[1].cpu_sample.cpu))
+		self.assertEqual((1, 3), samples.span(15, 25))
+		samples.crop(15)
+		self.assertEqual(1, len(samples))
+
+	def testProcessSamplesMerge(self):
+		def samples_at(times, state):
+			samples = parsing.ProcessSamples()
+			for time in times:
+				samples.add(time, state, 0.0, 0.0)
+			return samples
+		for others in [[[5, 25]], [[30, 40]], [[0, 10, 20, 20]], [[5, 25], [10, 15], [], [20]]]:
+			merged = samples_at([10, 20, 20], 'S')
+			expected = samples_at([10, 20, 20], 'S')
+			for n, times in enumerate(others):
+				expected.extend(samples_at(times, 'ABCD'[n]))
+			expected.sort()
+			merged.merge(*[samples_at(times, 'ABCD'[n]) for n, times in enumerate(others)])
+			self.assertEqual(list(expected.time), list(merged.time))
+			self.assertEqual(list(expected.state), list(merged.state))
+
+	def testMemSample(self):
+		sample = parsing.MemSample(10)
+		for name, value in zip(parsing.MemSample.used_values, range(6)):
+			self.assertFalse(sample.valid())
+			sample.add_value(name, value)
+		self.assertTrue(sample.valid())
+		self.assertEqual(1, sample.mem_free)
+		self.assertEqual(3, sample.records['Cached'])
+
+	def test_iterParseTimedBlocks(self):
+		data = io.StringIO("10\na b\nc d\n\n\n20\n\n30\ne f\n")
+		blocks = list(parsing._iter_parse_timed_blocks(data))
+		self.assertEqual([(10, ['a b', 'c d']), (20, []), (30, ['e f'])], blocks)
+
 	def testParseProcPsLog(self):
 		trace = parsing.Trace(writer, args, options)
 		state = parsing.parse_file(writer, trace, self.mk_fname('proc_ps.log'))
@@ -59,6 +119,100 @@ class TestBCParser(unittest.TestCase):
 			self.assertEqual(tokens[3], str(len(process.samples)))
 		ps_data.close()
 
+	def testReparentDeepChain(self):
+		trace = parsing.Trace(writer, args, options)
+		state = parsing.parse_file(writer, trace, self.mk_fname('proc_ps.log'))
+		pids = sorted(state.ps_stats.process_map.keys())
+		root, child = pids[0] // 1000, pids[-1] // 1000
+		# a chain of short lived forks, much deeper than the recursion limit
+		helpers = list(range(100000, 100000 + 5 * sys.getrecursionlimit()))
+		state.parent_map = dict(zip([child] + helpers, helpers + [root]))
+		state.parent_map[0] = 0
+		state.compile(writer)
+		self.assertEqual(root * 1000, state.ps_stats.process_map[child * 1000].ppid)
+
+	def testProcessIndex(self):
+		opts, paths = parser.parse_args(['--q', '--annotate', 'sh', '--annotate', 'udevd,rc', '--annotate', 'nonexistent', bootchart_dir])
+		trace = parsing.Trace(writer, paths, opts)
+		processes = trace.ps_stats.process_map.values()
+		shells = sorted([p for p in processes if 'sh' in (p.cmd, p.exe)], key=lambda p: (p.start_time, p.pid))
+		self.assertTrue(len(shells) > 1)
+		self.assertEqual(shells, trace.find_processes('sh'))
+		self.assertEqual(shells[0].start_time, trace.first_start(['sh']))
+		self.assertEqual(None, trace.first_start(['nonexistent']))
+		first = min(p.start_time for p in processes if p.cmd in ('udevd', 'rc') or p.exe in ('udevd', 'rc'))
+		self.assertEqual([None, shells[0].start_time, first, None], trace.times)
+		self.assertTrue(set(shells) <= trace.process_index.search('SH'))
+
+	def testSearchKernel(self):
+		tmp = tempfile.mkdtemp()
+		try:
+			for name in ('header', 'proc_diskstats.log', 'proc_ps.log', 'proc_stat.log'):
+				shutil.copy(self.mk_fname(name), tmp)
+			with open(os.path.join(tmp, 'dmesg'), 'w') as f:
+				f.write('[    0.100000] calling  pci_init+0x0/0x40 @ 1\n'
+					'[    0.200000] initcall pci_init+0x0/0x40 returned 0 after 97 usecs\n'
+					'[    0.300000] calling  acpi_init+0x0/0x40 @ 1\n'
+					'[    0.900000] initcall acpi_init+0x0/0x40 returned 0 after 600 usecs\n'
+					'[    1.000000] Freeing unused kernel memory: 100k freed\n')
+			opts, paths = parser.parse_args(['--q', '--no-prune', tmp])
+			trace = parsing.Trace(writer, paths, opts)
+		finally:
+			shutil.rmtree(tmp)
+		for kernel_only in (False, True):
+			tree = trace.kernel_tree if kernel_only else trace.proc_tree
+			found = [p.cmd for p in tree.rows if p.pid in trace.search('PCI_init', kernel_only)]
+			self.assertEqual(['pci_init'], found)
+			self.assertTrue(any(p.cmd == 'k-boot' for p in tree.rows if p.pid in trace.search('k-boot', kernel_only)))
+		self.assertTrue(any(p.cmd == 'udevd' for p in trace.proc_tree.rows if p.pid in trace.search('udevd')))
+		self.assertEqual(set(), trace.search('udevd', True))
+
+	def testProcessTotals(self):
+		trace = parsing.Trace(writer, args, options)
+		state = parsing.parse_file(writer, trace, self.mk_fname('proc_ps.log'))
+		state.compile(writer)
+		for proc in state.ps_stats.process_map.values():
+			samples = proc.samples
+			self.assertEqual(len(samples), proc.sample_count)
+			self.assertTrue(floatEq(sum(s.cpu_sample.user + s.cpu_sample.sys for s in samples), proc.cpu_total))
+			self.assertTrue(floatEq(sum(s.cpu_sample.io for s in samples), proc.io_total))
+			active = [s for s in samples if s.cpu_sample.user + s.cpu_sample.sys + s.cpu_sample.io > 0.0 or s.state == 'D']
+			self.assertEqual(len(active) + sum(1 for s in active if s.state == 'D' and
+							   s.cpu_sample.user + s.cpu_sample.sys + s.cpu_sample.io > 0.0),
+					 proc.active_count)
+			self.assertEqual(proc.active_count > 2, proc.active)
+
+	def testTraceViews(self):
+		def shape(tree):
+			return [(p.pid, p.cmd, p.start_time, p.duration, len(p.samples)) for p in tree.rows]
+
+		trace = parsing.Trace(writer, args, options)
+		pruned = trace.proc_tree
+		samples = dict((pid, len(p.samples)) for pid, p in trace.ps_stats.process_map.items())
+
+		trace.set_view(False, True, 'pid')
+		unpruned_options, _ = parser.parse_args(['--q', '--no-prune', '--sort', 'pid', bootchart_dir])
+		expected = parsing.Trace(writer, args, unpruned_options).proc_tree
+		self.assertEqual(shape(expected), shape(trace.proc_tree))
+
+		# the compiled processes are left as they were
+		for pid, proc in trace.ps_stats.process_map.items():
+			self.assertEqual(samples[pid], len(proc.samples))
+			self.assertEqual([], proc.child_list)
+
+		trace.set_view(options.prune, options.show_kernel, options.proc_sort)
+		self.assertTrue(trace.proc_tree is pruned)
+
+	def testUtilSeriesIdle(self):
+		util = parsing._UtilSeries([(0, 0.9), (100, 0.1), (200, 0.1), (300, 0.5), (400, 0.0), (500, 0.0)])
+		self.assertFalse(util.is_idle(0, 300, 0.25))
+		# 0.1, 0.1, 0.5, 0.0 averages to 0.175
+		self.assertTrue(util.is_idle(50, 300, 0.25))
+		self.assertFalse(util.is_idle(50, 300, 0.15))
+		self.assertFalse(util.is_idle(250, 300, 0.25))
+		self.assertTrue(util.is_idle(400, 300, 0.25))
+		self.assertFalse(util.is_idle(600, 300, 0.25))
+
 	def testparseProcDiskStatLog(self):
 		trace = parsing.Trace(writer, args, options)
 		state_with_headers = parsing.parse_file(writer, trace, self.mk_fname('header'))
@@ -0,0 +1,48 @@
+import sys
+import os
+import tarfile
+import timeit
+import unittest
+
+sys.path.insert(0, os.getcwd())
+
+import initviz.parsing as parsing
+
+def split_tokenizer(line):
+    """The former proc_ps.log tokenizer, kept as the baseline."""
+    tokens = line.split(' ')
+    if len(tokens) < 21:
+        return None
+    offset = [index for index, token in enumerate(tokens[1:]) if token[-1] == ')'][0]
+    return int(tokens[0]), ' '.join(tokens[1:2+offset]).strip('()'), tokens[2+offset], int(tokens[3+offset]), \
+        int(tokens[13+offset]), int(tokens[14+offset]), int(tokens[21+offset])
+
+class TestProcPsTokenizer(unittest.TestCase):
+
+    def setUp(self):
+        path = os.path.join(os.path.dirname(sys.argv[0]), '../../examples/5/busybox_bootlog.tgz')
+        with tarfile.open(path) as tf:
+            data = tf.extractfile('proc_ps.log').read().decode('utf-8')
+        self.lines = [line.strip() for line in data.split('\n')]
+        self.lines = [line for line in self.lines if line.count(' ') > 20]
+
+    def testSameFields(self):
+        for line in self.lines:
+            self.assertEqual(split_tokenizer(line), parsing._parse_proc_ps_line(line))
+
+    def testCommWithBlanks(self):
+        line = '42 (a) b) S 1 42 42 0 -1 0 0 0 0 0 7 3 0 0 20 0 1 0 250 0 0'
+        self.assertEqual((42, 'a) b', 'S', 1, 7, 3, 250), parsing._parse_proc_ps_line(line))
+
+    def testTruncatedLine(self):
+        self.assertEqual(None, parsing._parse_proc_ps_line('42 (a) S 1 42 42'))
+
+    def testSpeed(self):
+        number = 20
+        for name, tokenizer in [('split', split_tokenizer), ('rfind', parsing._parse_proc_ps_line)]:
+            elapsed = min(timeit.repeat(lambda: [tokenizer(line) for line in self.lines],
+                                        number=number, repeat=3))
+            sys.stderr.write('\n%s: %.2f us/line\n' % (name, elapsed * 1e6 / (number * len(self.lines))))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,7 @@ sys.path.insert(0, os.getcwd())
 import initviz.parsing as parsing
 import initviz.process_tree as process_tree
 import initviz.main as main
+from initviz.samples import Process
 
 if sys.version_info >= (3, 0):
     long = int
@@ -100,6 +101,150 @@ class TestProcessTree(unittest.TestCase):
         self.processtree.merge_runs(self.processtree.process_tree)
         process_tree = self.processtree.process_tree
         self.checkAgainstJavaExtract(self.mk_fname('extract.processtree.3e.log'), process_tree)
+        # the totals kept up by the merges are those of the merged samples
+        for proc in self.flatten(process_tree):
+            totals = proc.copy()
+            totals.calc_totals()
+            self.assertAlmostEqual(totals.cpu_total, proc.cpu_total)
+            self.assertAlmostEqual(totals.io_total, proc.io_total)
+            self.assertAlmostEqual(totals.swap_total, proc.swap_total)
+            self.assertEqual((totals.sample_count, totals.active_count), (proc.sample_count, proc.active_count))
+
+    def testSubtreeStats(self):
+        tree = self.processtree
+        tree.merge_logger(tree.process_tree, 'bootchartd', None, False)
+        tree.invalidate_stats(tree.process_tree)
+        for proc in self.flatten(tree.process_tree):
+            procs = self.flatten([proc])
+            stats = tree.get_stats([proc])
+            self.assertEqual(min(p.start_time for p in procs), stats.start_time)
+            self.assertEqual(max(p.pid for p in procs), stats.max_pid)
+            self.assertAlmostEqual(sum(sum(p.samples.user) + sum(p.samples.sys) for p in procs), stats.cpu)
+        collector = [p for p in self.flatten(tree.process_tree) if p.cmd in ('bootchartd', 'bootchart-colle')]
+        elided = set(self.flatten(collector))
+        self.assertEqual(max(p.start_time + p.duration for p in self.flatten(tree.process_tree) if p not in elided),
+                         tree.get_end_time(tree.process_tree))
+
+    def testStatsAfterPasses(self):
+        tree = self.processtree
+        tree.get_stats(tree.process_tree)
+        for name in tree.PASSES:
+            tree.reduce([name])
+            for proc in self.flatten(tree.process_tree):
+                procs = self.flatten([proc])
+                stats = tree.get_stats([proc])
+                self.assertEqual(min(p.start_time for p in procs), stats.start_time)
+                self.assertEqual(max(p.pid for p in procs), stats.max_pid)
+
+    def testMergeConcurrentSiblings(self):
+        def proc(pid, cmd, start, duration):
+            p = Process(self.writer, pid * 1000, cmd, 1000, start)
+            p.duration = duration
+            p.samples.add(start, 'R', 0.5, 0.0)
+            return p
+        parent = proc(1, 'init', 0, 100)
+        parent.child_list = [proc(2, 'sh', 0, 10), proc(3, 'java', 0, 100), proc(4, 'sh', 5, 15),
+                             proc(5, 'java', 10, 20), proc(6, 'sh', 50, 10), proc(7, 'sh', 19, 2)]
+        removed = self.processtree.merge_concurrent_siblings([parent])
+        self.assertEqual(3, removed)
+        self.assertEqual([2, 3, 6], [p.pid // 1000 for p in parent.child_list])
+        self.assertEqual((0, 21), (parent.child_list[0].start_time, parent.child_list[0].duration))
+        self.assertEqual([0, 5, 19], list(parent.child_list[0].samples.time))
+
+    def testPassPipeline(self):
+        def build(passes=None):
+            return process_tree.ProcessTree(self.writer, None, self.trace.ps_stats,
+                self.trace.ps_stats.sample_period, None, True, None, None, False, passes=passes)
+        default = build()
+        self.assertEqual(['merge_logger', 'prune', 'merge_exploders', 'merge_siblings', 'merge_runs'],
+                         [stats.name for stats in default.pass_stats])
+        nodes = self.processtree.num_nodes(self.processtree.process_tree)
+        for stats in default.pass_stats:
+            self.assertEqual(nodes, stats.nodes_in)
+            self.assertEqual(stats.nodes_in - stats.removed, stats.nodes_out)
+            nodes = stats.nodes_out
+        self.assertEqual(default.num_proc, nodes)
+        self.assertTrue(sum(stats.samples_moved for stats in default.pass_stats) > 0)
+
+        # remove_kernel_threads only runs when hiding them
+        skipped = build(['merge_logger', 'remove_kernel_threads', 'merge_runs'])
+        self.assertEqual(['merge_logger', 'merge_runs'], [stats.name for stats in skipped.pass_stats])
+        self.assertTrue(skipped.num_proc > default.num_proc)
+
+    def testLifetimeIndex(self):
+        self.processtree.update_layout()
+        rows = self.processtree.rows
+        index = self.processtree.lifetimes()
+        def alive(start, end):
+            return sorted((p for p in rows if p.start_time <= end and p.start_time + p.duration >= start),
+                          key=lambda p: (p.start_time, p.pid))
+        end_time = max(p.start_time + p.duration for p in rows)
+        for start in range(0, int(end_time) + 100, 37):
+            self.assertEqual(alive(start, start), index.at(start))
+            self.assertEqual(alive(start, start + 250), index.overlapping(start, start + 250))
+
+        def cpu(p, start, end):
+            return sum(s.cpu_sample.user + s.cpu_sample.sys for s in p.samples if start <= s.time <= end)
+        for start, end in [(0, end_time), (1000, 1500), (2000, 2100)]:
+            top = index.top_cpu(start, end, 5)
+            loads = sorted((cpu(p, start, end) for p in alive(start, end)), reverse=True)
+            self.assertEqual(loads[:5], [cpu(p, start, end) for p in top])
+        self.assertTrue(set(index.running_at(1000)) <= set(index.at(1000)))
+        # the prefix sums are built with the index, and only for its processes
+        self.assertEqual(set(rows), set(index.cpu_sums))
+
+    def testSubtreeFilters(self):
+        tree = self.processtree
+        tree.merge_logger(tree.process_tree, 'bootchartd', None, False)
+        tree.update_layout()
+        for proc in tree.rows:
+            self.assertEqual(self.flatten([proc]), tree.subtree(proc))
+            below = set(self.flatten(proc.child_list))
+            for other in tree.rows:
+                self.assertEqual(other in below, tree.is_descendant(other, proc))
+
+        roots = [tree.rows[row] for row in tree.subtree_roots(tree.find_rows(['rc']))]
+        self.assertTrue(len(roots) > 1)
+        kept = self.flatten(roots)
+        self.assertEqual(tree.num_proc - len(kept), tree.filter_subtrees(only=['rc']))
+        self.assertEqual(kept, tree.rows)
+        self.assertEqual(sorted(kept, key=lambda p: p.pid), tree.process_list)
+
+        rc = roots[0]
+        for row in range(len(tree.rows)):
+            children = [c for c in rc.child_list if tree.row_of[c] >= row]
+            self.assertEqual(children[0] if children else None, tree.first_child_from(rc, row))
+            for child in tree.rows[row].child_list:
+                self.assertEqual(row, tree.parent_rows[tree.row_of[child]])
+
+        excluded = rc.child_list[0]
+        pid = str(excluded.pid // 1000)
+        removed = len(tree.subtree(excluded))
+        self.assertEqual(removed, tree.filter_subtrees(exclude=[pid]))
+        self.assertEqual([p for p in kept if p not in self.flatten(kept[1:2])], tree.rows)
+        self.assertFalse(excluded in tree.process_list)
+        self.assertEqual(tree.num_proc, len(tree.process_list))
+
+        # the stats of what is left do not count the excluded processes
+        tree.get_stats(tree.process_tree)
+        latest = max(tree.rows, key=lambda p: p.pid)
+        tree.filter_subtrees(exclude=[str(latest.pid // 1000)])
+        self.assertFalse(latest in tree.rows)
+        self.assertEqual(max(p.pid for p in tree.rows), tree.get_max_pid(tree.process_tree))
+
+    def testLayout(self):
+        self.processtree.merge_logger(self.processtree.process_tree, 'bootchartd', None, False)
+        self.processtree.update_layout()
+        rows = self.processtree.rows
+        self.assertEqual(self.flatten(self.processtree.process_tree), rows)
+        self.assertEqual(len(rows), self.processtree.num_proc)
+        for row, proc in enumerate(rows):
+            size = self.processtree.subtree_size(proc)
+            self.assertEqual(len(self.flatten([proc])), size)
+            self.assertEqual(self.flatten(proc.child_list), rows[row+1:row+size])
+            for child in proc.child_list:
+                self.assertEqual(self.processtree.depths[row] + 1,
+                                 self.processtree.depths[self.processtree.row_of[child]])
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,190 @@
+import sys
+import os
+import random
+import timeit
+import unittest
+
+sys.path.insert(0, os.getcwd())
+
+import initviz.parsing as parsing
+import initviz.process_tree as process_tree
+import initviz.main as main
+from initviz.samples import Process
+
+# The former list editing passes, kept as the reference
+
+def legacy_prune(tree, process_subtree, parent):
+    def is_idle_background_process_without_children(p):
+        process_end = p.start_time + p.duration
+        return not p.active and \
+               process_end >= tree.start_time + tree.duration and \
+               p.start_time > tree.start_time and \
+               p.duration > 0.9 * tree.duration and \
+               tree.num_nodes(p.child_list) == 0
+
+    num_removed = 0
+    idx = 0
+    while idx < len(process_subtree):
+        p = process_subtree[idx]
+        if parent != None or len(p.child_list) == 0:
+            prune = False
+            if tree.exit_proc_pid is not None and p.pid == tree.exit_proc_pid:
+                prune = False
+            elif is_idle_background_process_without_children(p):
+                prune = True
+            elif p.duration <= 2 * tree.sample_period:
+                prune = True
+
+            if prune:
+                process_subtree.pop(idx)
+                for c in p.child_list:
+                    process_subtree.insert(idx, c)
+                num_removed += 1
+                continue
+            else:
+                num_removed += legacy_prune(tree, p.child_list, p)
+        else:
+            num_removed += legacy_prune(tree, p.child_list, p)
+        idx += 1
+    return num_removed
+
+def legacy_remove_kernel_threads(tree, process_subtree):
+    num_removed = 0
+    idx = 0
+    while idx < len(process_subtree):
+        p = process_subtree[idx]
+        if p.ppid == 2000 or (p.cmd.startswith('[') and p.cmd.endswith(']')):
+            process_subtree.pop(idx)
+            for c in p.child_list:
+                process_subtree.insert(idx, c)
+            num_removed += 1
+            continue
+        else:
+            num_removed += legacy_remove_kernel_threads(tree, p.child_list)
+        idx += 1
+    return num_removed
+
+def legacy_merge_siblings(tree, process_subtree):
+    num_removed = 0
+    idx = 0
+    while idx < len(process_subtree)-1:
+        p = process_subtree[idx]
+        nextp = process_subtree[idx+1]
+        if nextp.cmd == p.cmd:
+            process_subtree.pop(idx+1)
+            idx -= 1
+            num_removed += 1
+            p.child_list.extend(nextp.child_list)
+            tree.merge_processes(p, nextp)
+        num_removed += legacy_merge_siblings(tree, p.child_list)
+        idx += 1
+    if len(process_subtree) > 0:
+        p = process_subtree[-1]
+        num_removed += legacy_merge_siblings(tree, p.child_list)
+    return num_removed
+
+class Writer:
+    def error(self, msg): pass
+    def warn(self, msg): pass
+    def info(self, msg): pass
+    def status(self, msg): pass
+
+def synthetic_tree(seed, width, depth):
+    """A random tree of short and long lived processes, some of them kernel threads."""
+    rand = random.Random(seed)
+    processes = [Process(Writer(), 1000, 'init', 0, 0)]
+    processes[0].duration = 1000
+    frontier = [processes[0]]
+    for level in range(depth):
+        next_frontier = []
+        for parent in frontier:
+            for i in range(rand.randint(0, width)):
+                pid = (len(processes) + 1) * 1000
+                cmd = rand.choice(['sh', 'sh', 'java', '[kworker]', 'udevd', 'modprobe'])
+                proc = Process(Writer(), pid, cmd, parent.pid, rand.randint(0, 900))
+                proc.duration = rand.choice([1, 2, 5, 50, 500])
+                proc.active = rand.random() < 0.5
+                proc.parent = parent
+                proc.samples.add(proc.start_time, 'R', 0.1, 0.1)
+                processes.append(proc)
+                next_frontier.append(proc)
+        frontier = next_frontier
+    tree = process_tree.ProcessTree(Writer(), processes, None, 2, None, False, None, None, True,
+                                    for_testing=True)
+    return tree
+
+def shape(process_list):
+    """The pid, times, samples and children of every process, in tree order."""
+    return [(p.pid, p.cmd, p.start_time, p.duration, list(p.samples.time), [c.pid for c in p.child_list])
+            for p in _flatten(process_list)]
+
+def _flatten(process_list):
+    flattened = []
+    for p in process_list:
+        flattened.append(p)
+        flattened.extend(_flatten(p.child_list))
+    return flattened
+
+class TestPruneEquivalence(unittest.TestCase):
+
+    def setUp(self):
+        self.rootdir = os.path.join(os.path.dirname(sys.argv[0]), '../../examples/1/')
+        parser = main._mk_options_parser()
+        self.options, self.args = parser.parse_args(['--q', self.rootdir])
+        self.writer = main._mk_writer(self.options)
+
+    def fixture_tree(self):
+        trace = parsing.Trace(self.writer, self.args, self.options)
+        parsing.parse_file(self.writer, trace, os.path.join(self.rootdir, 'proc_ps.log'))
+        trace.compile(self.writer)
+        tree = process_tree.ProcessTree(self.writer, None, trace.ps_stats,
+            trace.ps_stats.sample_period, None, self.options.prune, None, None, False, for_testing = True)
+        tree.merge_logger(tree.process_tree, 'bootchartd', None, False)
+        return tree
+
+    def checkPasses(self, make_tree):
+        for legacy, rebuilt in [
+                (lambda t: legacy_prune(t, t.process_tree, None), lambda t: t.prune(t.process_tree, None)),
+                (lambda t: legacy_remove_kernel_threads(t, t.process_tree), lambda t: t.remove_kernel_threads(t.process_tree)),
+                (lambda t: legacy_merge_siblings(t, t.process_tree), lambda t: t.merge_siblings(t.process_tree))]:
+            expected, actual = make_tree(), make_tree()
+            self.assertEqual(legacy(expected), rebuilt(actual))
+            self.assertEqual(shape(expected.process_tree), shape(actual.process_tree))
+
+    def testFixture(self):
+        self.checkPasses(self.fixture_tree)
+
+    def testSynthetic(self):
+        for seed in range(20):
+            self.checkPasses(lambda: synthetic_tree(seed, 6, 4))
+
+class TestPruneScaling(unittest.TestCase):
+
+    def wide_tree(self, width):
+        # every short lived child of init has a child which moves up
+        processes = [Process(Writer(), 1000, 'init', 0, 0)]
+        processes[0].duration = 1000
+        for i in range(width):
+            proc = Process(Writer(), (2 * i + 2) * 1000, 'sh', 1000, i % 500)
+            proc.duration = 1
+            proc.parent = processes[0]
+            child = Process(Writer(), (2 * i + 3) * 1000, 'sleep', proc.pid, i % 500)
+            child.duration = 10
+            child.parent = proc
+            processes.extend([proc, child])
+        return process_tree.ProcessTree(Writer(), processes, None, 2, None, False, None, None, True,
+                                        for_testing=True)
+
+    def testSpeed(self):
+        for width in (8000, 32000, 64000):
+            timings = [('rebuilt', lambda t: t.prune(t.process_tree, None))]
+            if width <= 32000:
+                timings.append(('legacy', lambda t: legacy_prune(t, t.process_tree, None)))
+            for name, prune in timings:
+                tree = self.wide_tree(width)
+                elapsed = timeit.timeit(lambda: prune(tree), number=1)
+                self.assertEqual(width, len(tree.process_tree[0].child_list))
+                sys.stderr.write('\n%s prune of %d siblings: %.3f s\n' % (name, width, elapsed))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import sys
+import os
+import threading
+import unittest
+import concurrent.futures
+
+sys.path.insert(0, os.getcwd())
+
+import initviz.draw as draw
+import initviz.main as main
+import initviz.parsing as parsing
+import initviz.tiles as tiles
+
+class TestTileCache(unittest.TestCase):
+
+    def setUp(self):
+        rootdir = os.path.join(os.path.dirname(sys.argv[0]), '../../examples/1/')
+        parser = main._mk_options_parser()
+        app_options, args = parser.parse_args(['--q', rootdir])
+        self.trace = parsing.Trace(main._mk_writer(app_options), args, app_options)
+        self.options = draw.RenderOptions(app_options)
+
+    def testTileRange(self):
+        cache = tiles.TileCache(self.trace)
+        w, h = draw.extents(self.options, 1.0, self.trace)
+        cols, rows = cache.tile_range(self.options, 1.0, 2.0, 0, 0, 100000, 100000)
+        self.assertEqual(range(0, -(-2 * w // tiles.TILE_SIZE)), cols)
+        self.assertEqual(range(0, -(-2 * h // tiles.TILE_SIZE)), rows)
+        cols, rows = cache.tile_range(self.options, 1.0, 2.0, 200, 300, 300, 100)
+        self.assertEqual(range(1, 3), cols)
+        self.assertEqual(range(2, 3), rows)
+
+    def testCached(self):
+        cache = tiles.TileCache(self.trace)
+        tile = cache.tile(self.options, 1.0, 1.0, 0, 1)
+        self.assertTrue(cache.tile(self.options, 1.0, 1.0, 0, 1) is tile)
+        self.assertFalse(cache.tile(self.options, 1.0, 2.0, 0, 1) is tile)
+        self.options.search_query = 'udev'
+        self.assertFalse(cache.tile(self.options, 1.0, 1.0, 0, 1) is tile)
+        self.assertEqual(3, cache.rendered)
+
+    def testEviction(self):
+        cache = tiles.TileCache(self.trace, 3 * tiles.TILE_BYTES)
+        first = cache.tile(self.options, 1.0, 1.0, 0, 0)
+        for row in range(1, 4):
+            cache.tile(self.options, 1.0, 1.0, 0, row)
+            # recently used, so kept
+            self.assertTrue(cache.tile(self.options, 1.0, 1.0, 0, 0) is first)
+        self.assertEqual(3 * tiles.TILE_BYTES, cache.size)
+        self.assertEqual(None, cache.lookup((tiles.options_key(self.options), 1.0, 1.0, 0, 1)))
+        self.assertEqual(4, cache.rendered)
+
+    def testNewView(self):
+        cache = tiles.TileCache(self.trace)
+        cache.tile(self.options, 1.0, 1.0, 0, 0)
+        self.trace.set_view(False, True, 'pid')
+        cache.tile(self.options, 1.0, 1.0, 0, 0)
+        self.assertEqual(1, len(cache.tiles))
+        self.assertEqual(2, cache.rendered)
+
+class Context:
+    """Records the tiles painted."""
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name,) + args)
+
+class TestBackgroundRendering(unittest.TestCase):
+
+    def setUp(self):
+        rootdir = os.path.join(os.path.dirname(sys.argv[0]), '../../examples/1/')
+        parser = main._mk_options_parser()
+        app_options, args = parser.parse_args(['--q', rootdir])
+        self.trace = parsing.Trace(main._mk_writer(app_options), args, app_options)
+        self.options = draw.RenderOptions(app_options)
+        self.cache = tiles.TileCache(self.trace)
+        self.ready = threading.Semaphore(0)
+        self.cache.start(self.ready.release)
+
+    def tearDown(self):
+        self.cache.shutdown()
+
+    def wait(self):
+        concurrent.futures.wait(list(self.cache.pending.values()))
+
+    def testProgressive(self):
+        size = tiles.TILE_SIZE
+        ctx = Context()
+        self.cache.paint(ctx, self.options, 1.0, 1.0, 0, 0, size, 2 * size)
+        # nothing to paint until the worker is done
+        self.assertFalse([call for call in ctx.calls if call[0] == 'set_source_surface'])
+        self.assertEqual(2, len(self.cache.pending))
+        self.ready.acquire()
+        self.ready.acquire()
+        ctx = Context()
+        self.cache.paint(ctx, self.options, 1.0, 1.0, 0, 0, size, 2 * size)
+        self.assertEqual(2, len([call for call in ctx.calls if call[0] == 'set_source_surface']))
+        self.assertEqual({}, self.cache.pending)
+        self.assertEqual(2, self.cache.rendered)
+
+        # zoomed in, the tiles at the old zoom stand in for the new ones
+        ctx = Context()
+        self.cache.paint(ctx, self.options, 1.0, 2.0, 0, 0, size, size)
+        old = self.cache.lookup((tiles.options_key(self.options), 1.0, 1.0, 0, 0))
+        self.assertEqual([old], [call[1] for call in ctx.calls if call[0] == 'set_source_surface'])
+        self.assertTrue(('scale', 2.0, 2.0) in ctx.calls)
+        self.wait()
+
+    def testCancelStale(self):
+        size = tiles.TILE_SIZE
+        # hold up the worker while the view moves on
+        with draw._render_lock:
+            self.cache.paint(Context(), self.options, 1.0, 1.0, 0, 0, 3 * size, size)
+            first = dict(self.cache.pending)
+            self.cache.paint(Context(), self.options, 1.0, 1.0, 0, 2 * size, size, size)
+            self.assertEqual(1, len(self.cache.pending))
+            # the job the worker already started can not be cancelled
+            self.assertTrue(len([job for job in first.values() if job.cancelled()]) >= 2)
+        self.wait()
+        self.assertTrue(self.cache.rendered <= 2)
+        self.assertTrue(self.cache.lookup((tiles.options_key(self.options), 1.0, 1.0, 0, 2)) is not None)
+
+    def testShutdown(self):
+        with draw._render_lock:
+            self.cache.paint(Context(), self.options, 1.0, 1.0, 0, 0, 100, 100)
+            jobs = list(self.cache.pending.values())
+            self.cache.shutdown()
+        concurrent.futures.wait(jobs)
+        # the job which was running finished without telling anyone
+        self.assertFalse(self.ready.acquire(blocking=False))
+
+    def testNewView(self):
+        with draw._render_lock:
+            self.cache.paint(Context(), self.options, 1.0, 1.0, 0, 0, 100, 100)
+            generation = self.cache.generation
+            self.trace.set_view(False, True, 'pid')
+            self.cache.paint(Context(), self.options, 1.0, 1.0, 0, 0, 100, 100)
+            self.assertEqual(generation + 1, self.cache.generation)
+        self.wait()
+        # whatever was rendered for the old view is not kept
+        self.assertEqual(1, len(self.cache.tiles))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,238 @@
+#  This file is part of initviz.
+
+#  initviz is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  initviz is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with initviz. If not, see <http://www.gnu.org/licenses/>.
+
+"""Pre-rendered tiles of a chart, for the interactive viewer.
+
+The chart, scaled by the zoom, is cut into square tiles of TILE_SIZE device
+pixels.  A tile is rendered once, into an image surface, and painted from
+there until it is evicted: least recently used first, once the tiles take
+more memory than the budget.
+
+Once started, a TileCache renders the tiles on a worker thread.  Until a
+tile is ready, what the cache holds of the same area at other zooms is
+painted in its place, and tiles which scrolled out of view before the
+worker got to them are cancelled.
+"""
+
+import concurrent.futures
+import copy
+import math
+import threading
+from collections import OrderedDict
+
+import cairo
+
+from . import draw
+
+TILE_SIZE = 256
+# 4 bytes a pixel
+TILE_BYTES = TILE_SIZE * TILE_SIZE * 4
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+def options_key(options):
+    """The render options which change what a tile looks like."""
+    app_options = options.app_options
+    return (options.kernel_only, options.charts, options.cumulative, options.search_query,
+            getattr(app_options, 'show_pid', False), getattr(app_options, 'show_all', False))
+
+def snapshot_options(options):
+    """A copy of options which the GUI can go on changing."""
+    options = copy.copy(options)
+    options.app_options = copy.copy(options.app_options)
+    return options
+
+def render_tile(trace, options, xscale, zoom, col, row):
+    """Returns an image surface with the tile at col, row of the chart."""
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, TILE_SIZE, TILE_SIZE)
+    ctx = cairo.Context(surface)
+    ctx.set_source_rgb(1.0, 1.0, 1.0)
+    ctx.paint()
+    ctx.translate(-col * TILE_SIZE, -row * TILE_SIZE)
+    ctx.scale(zoom, zoom)
+    # the clip extents limit what render() draws to this tile
+    draw.render(ctx, options, xscale, trace)
+    surface.flush()
+    return surface
+
+class TileCache:
+    def __init__(self, trace, max_bytes=DEFAULT_MAX_BYTES):
+        self.trace = trace
+        self.max_bytes = max_bytes
+        self.tiles = OrderedDict()
+        self.proc_tree = None
+        self.rendered = 0
+        # the tiles are shared with the worker
+        self.lock = threading.Lock()
+        self.executor = None
+        self.notify = None
+        self.pending = {}
+        # bumped whenever the tiles are dropped, so that jobs started
+        # before do not store theirs
+        self.generation = 0
+
+    @property
+    def size(self):
+        return len(self.tiles) * TILE_BYTES
+
+    def start(self, notify):
+        """Render tiles on a worker thread from now on, calling notify on
+        that thread whenever one is ready."""
+        self.notify = notify
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def shutdown(self):
+        """Stop rendering in the background.  A job which is running still
+        finishes, but does not call notify any more."""
+        if self.executor is None:
+            return
+        with self.lock:
+            self.notify = None
+        self.cancel(())
+        self.executor.shutdown(wait=False)
+        self.executor = None
+
+    def clear(self):
+        with self.lock:
+            self.tiles.clear()
+            self.generation += 1
+        self.cancel(())
+
+    def cancel(self, wanted):
+        """Cancel the jobs for the tiles not in wanted, and forget those
+        which are done."""
+        for key, job in list(self.pending.items()):
+            if key not in wanted or job.done():
+                job.cancel()
+                del self.pending[key]
+
+    def tile_range(self, options, xscale, zoom, x, y, width, height):
+        """Returns the columns and rows of the tiles covering the width x height
+        device pixels at chart coordinates x, y."""
+        chart_w, chart_h = draw.extents(options, xscale, self.trace)
+        dx, dy = int(round(x * zoom)), int(round(y * zoom))
+        right = min(dx + width, math.ceil(chart_w * zoom))
+        bottom = min(dy + height, math.ceil(chart_h * zoom))
+        return (range(max(dx, 0) // TILE_SIZE, max(int(math.ceil(right / TILE_SIZE)), 0)),
+                range(max(dy, 0) // TILE_SIZE, max(int(math.ceil(bottom / TILE_SIZE)), 0)))
+
+    def lookup(self, key):
+        """Returns the tile for key, or None if it is not rendered."""
+        with self.lock:
+            surface = self.tiles.get(key)
+            if surface is not None:
+                self.tiles.move_to_end(key)
+            return surface
+
+    def store(self, key, surface, generation=None):
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.tiles[key] = surface
+            self.tiles.move_to_end(key)
+            # keep at least the tile just stored
+            while len(self.tiles) > 1 and self.size > self.max_bytes:
+                self.tiles.popitem(last=False)
+
+    def check_view(self, options):
+        """Drop the tiles when the process tree view has changed."""
+        proc_tree = options.proc_tree(self.trace)
+        if proc_tree is not self.proc_tree:
+            self.clear()
+            self.proc_tree = proc_tree
+
+    def tile(self, options, xscale, zoom, col, row):
+        """Returns the tile at col, row, rendering it if needed."""
+        self.check_view(options)
+        key = (options_key(options), xscale, zoom, col, row)
+        surface = self.lookup(key)
+        if surface is None:
+            surface = render_tile(self.trace, options, xscale, zoom, col, row)
+            self.rendered += 1
+            self.store(key, surface)
+        return surface
+
+    def submit(self, key, options, xscale, zoom, col, row):
+        if key in self.pending:
+            return
+        self.pending[key] = self.executor.submit(self.render_job, key, snapshot_options(options),
+                                                 xscale, zoom, col, row, self.generation)
+
+    def render_job(self, key, options, xscale, zoom, col, row, generation):
+        surface = render_tile(self.trace, options, xscale, zoom, col, row)
+        self.rendered += 1
+        self.store(key, surface, generation)
+        with self.lock:
+            if self.notify is not None:
+                self.notify()
+
+    def stand_ins(self, key):
+        """Returns the tiles of the same chart at other zooms, those at the
+        zoom nearest to that of key last."""
+        okey, xscale, zoom = key[:3]
+        with self.lock:
+            keys = [other for other in self.tiles
+                    if other[:2] == (okey, xscale) and other[2] != zoom]
+            keys.sort(key=lambda other: -abs(math.log(other[2] / zoom)))
+            return [(other, self.tiles[other]) for other in keys]
+
+    def paint_stand_ins(self, cr, key, dx, dy):
+        """Paints the tile for key, which is not rendered yet, from the tiles
+        at other zooms which overlap it."""
+        zoom, col, row = key[2:]
+        left, top = col * TILE_SIZE / zoom, row * TILE_SIZE / zoom
+        right, bottom = left + TILE_SIZE / zoom, top + TILE_SIZE / zoom
+        for (_, _, other_zoom, other_col, other_row), surface in self.stand_ins(key):
+            size = TILE_SIZE / other_zoom
+            other_left, other_top = other_col * size, other_row * size
+            if other_left >= right or other_left + size <= left or \
+               other_top >= bottom or other_top + size <= top:
+                continue
+            cr.save()
+            cr.rectangle(col * TILE_SIZE - dx, row * TILE_SIZE - dy, TILE_SIZE, TILE_SIZE)
+            cr.clip()
+            cr.translate(-dx, -dy)
+            cr.scale(zoom / other_zoom, zoom / other_zoom)
+            cr.set_source_surface(surface, other_col * TILE_SIZE, other_row * TILE_SIZE)
+            cr.paint()
+            cr.restore()
+
+    def paint(self, cr, options, xscale, zoom, x, y, width, height):
+        """Paints the width x height device pixels at chart coordinates x, y
+        onto cr, whose origin is the top left of that area.  Once started,
+        the tiles not rendered yet are queued for the worker, and the jobs
+        for tiles which are no longer in view are cancelled."""
+        dx, dy = int(round(x * zoom)), int(round(y * zoom))
+        cols, rows = self.tile_range(options, xscale, zoom, x, y, width, height)
+        self.check_view(options)
+        okey = options_key(options)
+        wanted = set()
+        for row in rows:
+            for col in cols:
+                key = (okey, xscale, zoom, col, row)
+                if self.executor is None:
+                    surface = self.tile(options, xscale, zoom, col, row)
+                else:
+                    surface = self.lookup(key)
+                if surface is None:
+                    wanted.add(key)
+                    self.submit(key, options, xscale, zoom, col, row)
+                    self.paint_stand_ins(cr, key, dx, dy)
+                    continue
+                cr.set_source_surface(surface, col * TILE_SIZE - dx, row * TILE_SIZE - dy)
+                cr.rectangle(col * TILE_SIZE - dx, row * TILE_SIZE - dy, TILE_SIZE, TILE_SIZE)
+                cr.fill()
+        if self.executor is not None:
+            self.cancel(wanted)